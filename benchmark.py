@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows - brak pomiaru RSS
+    resource = None
+
+
+def peak_rss_kb():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS podaje bajty
+
+
+def run_isolated(func, *args):
+    # Każdy pomiar w świeżym procesie, żeby szczytowe RSS nie mieszało się między wariantami
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(func, *args).result()
+
+
+def preview_variant(variant, paths, size, repeat):
+    from PIL import Image
+    import thumbnails
+
+    baseline_rss = peak_rss_kb()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            if variant == "full":
+                # Pełne dekodowanie w oryginalnej rozdzielczości przed zmniejszeniem
+                image = Image.open(path)
+                image.load()
+                image.thumbnail((size, size))
+            elif variant == "current":
+                # Dotychczasowa ścieżka display_file
+                image = Image.open(path)
+                image.thumbnail((size, size))
+            else:
+                image = thumbnails.render_thumbnail(path, size)
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss_kb() - baseline_rss
+
+
+def bench_previews(args):
+    paths = [p for p in args.paths if os.path.isfile(p)]
+    if not paths:
+        print("No image files given.")
+        return
+    print(f"{len(paths)} files, thumbnail {args.size}px, {args.repeat} repeats")
+    print(f"{'variant':<10}{'ms/image':>12}{'peak RSS +KB':>16}")
+    for variant in ("full", "current", "fast"):
+        elapsed, rss = run_isolated(preview_variant, variant, paths, args.size, args.repeat)
+        per_image = elapsed * 1000 / (len(paths) * args.repeat)
+        print(f"{variant:<10}{per_image:>12.1f}{rss:>16,}")
+
+
+def synthetic_files(count, seed=1):
+    # Drzewo przypominające archiwum: ~100 plików na katalog, powtarzające się nazwy,
+    # rozmiary log-normalne (mediana ~400 KB), więc kolizje dotyczą głównie małych plików
+    import random
+    rng = random.Random(seed)
+    for i in range(count):
+        directory = f"/mnt/share/archive/{i // 10000:04d}/album_{i // 100:06d}"
+        name = f"IMG_{rng.randrange(count // 4 + 1):06d}.jpg"
+        size = min(int(rng.lognormvariate(13, 2.5)), 1 << 40)
+        yield name, size, f"{directory}/{name}"
+
+
+def measure_allocations(build):
+    import tracemalloc
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def bench_filetable(args):
+    import grouping
+    from file_table import FileTable
+
+    if args.folder:
+        import scanner
+        # Krotki z dysku zapisujemy jako proste pola, żeby każdy wariant sam alokował swoje napisy
+        fields = [(os.path.dirname(p), n, s) for n, s, p in scanner.scan_tree(args.folder)]
+        source = lambda: ((name, size, os.path.join(d, name)) for d, name, size in fields)
+    else:
+        source = lambda: synthetic_files(args.files)
+
+    # Stary format: lista krotek (nazwa, rozmiar, pełna ścieżka)
+    tuples, tuple_bytes = measure_allocations(lambda: list(source()))
+    count = len(tuples)
+    print(f"{count:,} files")
+    del tuples
+
+    def build_table():
+        table = FileTable()
+        for name, size, path in source():
+            table.append(os.path.dirname(path), name, size, 0)
+        return table
+
+    table, table_bytes = measure_allocations(build_table)
+    print(f"{'store':<14}{'bytes/file':>12}")
+    print(f"{'tuple list':<14}{tuple_bytes / count:>12.1f}")
+    print(f"{'FileTable':<14}{table_bytes / count:>12.1f}")
+
+    index = grouping.FileIndex(table)
+    for label, criteria in (("name", (True, False)), ("size", (False, True)), ("name+size", (True, True))):
+        start = time.perf_counter()
+        groups = index.group({"name": criteria[0], "size": criteria[1], "content": False, "video": False})
+        print(f"group by {label:<10}{(time.perf_counter() - start) * 1000:>10.0f} ms{len(groups):>12,} groups")
+
+
+def dict_grouping(file_info, by_name):
+    # Dotychczasowa gałąź filter_files: defaultdict po kluczu, potem druga pętla bez singletonów
+    from collections import defaultdict
+    file_dict = defaultdict(list)
+    for name, size, path in file_info:
+        file_dict[(name, size) if by_name else size].append((size, path))
+    return {key: items for key, items in file_dict.items() if len(items) > 1}
+
+
+def bench_grouping(args):
+    import grouping
+    from file_table import FileTable, np
+
+    if np is None:
+        print("NumPy is not installed - nothing to compare.")
+        return
+    file_info = list(synthetic_files(args.files))
+    table = FileTable()
+    for name, size, path in file_info:
+        table.append(os.path.dirname(path), name, size, 0)
+    print(f"{len(file_info):,} files")
+    # argsort: grupy jako tablice NumPy; +lists: dodatkowo zamienione na listy Pythona dla UI
+    print(f"{'key':<12}{'groups':>10}{'defaultdict':>14}{'argsort':>10}{'reused':>10}{'+lists':>10}{'speedup':>10}")
+    for label, by_name in (("size", False), ("name+size", True)):
+        start = time.perf_counter()
+        expected = dict_grouping(file_info, by_name)
+        dict_time = time.perf_counter() - start
+
+        index = grouping.FileIndex(table)
+        start = time.perf_counter()
+        rows, starts, ends = index.run_bounds(by_name, True)
+        first_time = time.perf_counter() - start
+        start = time.perf_counter()
+        index.run_bounds(by_name, True)
+        reused_time = time.perf_counter() - start
+        start = time.perf_counter()
+        runs = index.runs(by_name, True)
+        lists_time = time.perf_counter() - start
+
+        assert len(runs) == len(starts) == len(expected), "grouping results differ"
+        print(f"{label:<12}{len(runs):>10,}{dict_time * 1000:>11.0f} ms{first_time * 1000:>7.0f} ms"
+              f"{reused_time * 1000:>7.0f} ms{lists_time * 1000:>7.0f} ms{dict_time / first_time:>9.1f}x")
+
+
+def read_hash(path):
+    # Dotychczasowa pętla full_hash: nowy obiekt bytes na każdy blok
+    import hashing
+    hasher = hashing.new_hasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(hashing.CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def bench_hashing(args):
+    import hashing
+
+    def mmap_hash(path):
+        return hashing.full_hash(path, use_mmap=True)
+
+    paths = [p for p in args.paths if os.path.isfile(p)]
+    total = sum(os.path.getsize(p) for p in paths)
+    if not total:
+        print("No non-empty files given.")
+        return
+    print(f"{len(paths)} files, {total / 2 ** 30:.2f} GB, {args.repeat} repeats (page cache warm after the first)")
+    print(f"{'variant':<10}{'CPU s/GB':>10}{'wall s/GB':>11}{'GB/s':>8}")
+    expected = None
+    for label, func in (("read", read_hash), ("readinto", hashing.full_hash), ("mmap", mmap_hash)):
+        digests = [func(p) for p in paths]  # rozgrzewka
+        assert expected is None or digests == expected, "digests differ"
+        expected = digests
+        cpu, wall = time.process_time(), time.perf_counter()
+        for _ in range(args.repeat):
+            for path in paths:
+                func(path)
+        gigabytes = total * args.repeat / 2 ** 30
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        print(f"{label:<10}{cpu / gigabytes:>10.2f}{wall / gigabytes:>11.2f}{gigabytes / wall:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File manager micro-benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    previews = commands.add_parser("previews", help="JPEG/PNG preview decode time and peak RSS")
+    previews.add_argument("paths", nargs="+")
+    previews.add_argument("--size", type=int, default=400)
+    previews.add_argument("--repeat", type=int, default=3)
+    previews.set_defaults(func=bench_previews)
+
+    filetable = commands.add_parser("filetable", help="memory per file of the scan table and grouping time")
+    filetable.add_argument("folder", nargs="?", help="scan this folder instead of generating synthetic files")
+    filetable.add_argument("--files", type=int, default=1_000_000)
+    filetable.set_defaults(func=bench_filetable)
+
+    grouping = commands.add_parser("grouping", help="defaultdict vs NumPy argsort size-collision grouping")
+    grouping.add_argument("--files", type=int, default=5_000_000)
+    grouping.set_defaults(func=bench_grouping)
+
+    hashing = commands.add_parser("hashing", help="full-file hashing: read() vs readinto buffer vs mmap")
+    hashing.add_argument("paths", nargs="+")
+    hashing.add_argument("--repeat", type=int, default=3)
+    hashing.set_defaults(func=bench_hashing)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import csv
+import errno
+import datetime
+from collections import defaultdict
+import hashing
+import storage
+
+try:
+    import fcntl
+except ImportError:  # Windows - bez klonowania przez ioctl
+    fcntl = None
+
+KEEP_RULES = ("newest", "largest", "first")
+LINK_MODES = ("hardlink", "reflink")
+BATCH_SIZE = 500  # co tyle plików raportujemy postęp i sprawdzamy anulowanie
+FICLONE = 0x40049409  # ioctl z linux/fs.h: współdzielenie bloków pliku (btrfs, XFS, bcachefs)
+
+
+def choose_keeper(items, keep):
+    """Return the index of the file to keep in a group of (size, path) items; ties go to the first."""
+    if keep == "largest":
+        return max(range(len(items)), key=lambda i: (items[i][0], -i))
+    elif keep == "newest":
+        mtimes = []
+        for _, path in items:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(-1)
+        return max(range(len(items)), key=lambda i: (mtimes[i], -i))
+    return 0
+
+
+def remove_batch(paths):
+    """Remove files and return [(path, error or None)].
+
+    Paths are grouped by directory; where the platform supports it every
+    directory is opened once and its files are unlinked relative to it,
+    so the kernel does not resolve the full path again for each file.
+    """
+    by_dir = defaultdict(list)
+    for path in paths:
+        by_dir[os.path.dirname(path)].append(os.path.basename(path))
+    use_dir_fd = os.unlink in os.supports_dir_fd
+    results = []
+    for directory, names in by_dir.items():
+        dir_fd = None
+        if use_dir_fd:
+            try:
+                dir_fd = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+            except OSError:
+                dir_fd = None
+        try:
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if dir_fd is not None:
+                        os.unlink(name, dir_fd=dir_fd)
+                    else:
+                        os.remove(path)
+                    results.append((path, None))
+                except OSError as e:
+                    results.append((path, str(e)))
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+    return results
+
+
+def bulk_delete(groups, keep, cache=None, progress=None, cancel=None, links=None):
+    """Keep one file per set of identical files (by the `keep` rule) and delete the others.
+
+    `groups` is {name: [(size, path), ...]}; `links` maps a path to the
+    other paths (hardlinks) of the same file, which are deleted with it
+    (with size 0 in the results) while they still point to that file.
+    Groups come from any comparison mode, so every group is first split by
+    content (through `cache`, a HashCache, when given) and files are
+    deleted only inside byte-identical subgroups; a file without an
+    identical copy, or changed since verification, is skipped. Groups of
+    whole directories are left alone. Files are removed in batches of
+    BATCH_SIZE; `progress(done, total)` is called after each batch and
+    setting `cancel` stops before the next group. Returns (results,
+    cancelled), results being (status, group, path, kept, size, error) rows
+    as written by write_log.
+    """
+    groups = {name: items for name, items in groups.items()
+              # Grupy całych katalogów (FileIndex.directory_groups) tylko pokazujemy - drzew nie usuwamy hurtowo
+              if len(items) > 1 and not os.path.isdir(items[0][1])}
+    total = sum(len(items) for items in groups.values())
+    results = []
+    batch = {}
+    done = 0
+
+    def flush():
+        for path, error in remove_batch(list(batch)):
+            name, kept, size = batch[path]
+            results.append(("failed" if error else "deleted", name, path, kept, size, error or ""))
+        batch.clear()
+
+    for name, items in groups.items():
+        if cancel is not None and cancel.is_set():
+            break
+        identities = {}
+        for size, path in items:
+            try:
+                identities[path] = file_identity(path)
+            except OSError as e:
+                results.append(("failed", name, path, "", size, str(e)))
+        identical = set()
+        for _, same in hashing.split_by_content([item for item in items if item[1] in identities], cache):
+            kept = same[choose_keeper(same, keep)][1]
+            for size, path in same:
+                identical.add(path)
+                if path == kept:
+                    continue
+                try:
+                    unchanged = file_identity(path) == identities[path] and file_identity(kept) == identities[kept]
+                except OSError as e:
+                    results.append(("skipped", name, path, kept, size, str(e)))
+                    continue
+                if not unchanged:
+                    results.append(("skipped", name, path, kept, size, "changed since verification"))
+                    continue
+                if identities[path][:2] == identities[kept][:2]:
+                    # Dowiązanie symboliczne do zachowanego pliku (albo na odwrót) - usunięcie straciłoby dane
+                    results.append(("skipped", name, path, kept, size, "same file as kept"))
+                    continue
+                batch[path] = (name, kept, size)
+                for link in (links or {}).get(path, ()):
+                    try:
+                        same_file = file_identity(link)[:2] == identities[path][:2]
+                    except OSError as e:
+                        results.append(("skipped", name, link, kept, 0, str(e)))
+                        continue
+                    if not same_file:
+                        # Ścieżka wskazuje już inny plik - nie ma go czym zastąpić
+                        results.append(("skipped", name, link, kept, 0, "changed since verification"))
+                        continue
+                    batch[link] = (name, kept, 0)  # miejsce zwalnia się raz, liczymy je przy samym pliku
+        results.extend(("skipped", name, path, "", size, "no identical copy")
+                       for size, path in items if path in identities and path not in identical)
+        done += len(items)
+        if len(batch) >= BATCH_SIZE:
+            flush()
+            if progress is not None:
+                progress(done, total)
+    flush()
+    return results, cancel is not None and cancel.is_set()
+
+
+def clone_file(source, target):
+    """Create target as a reflink clone of source (copy-on-write, no data is copied)."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(source, "rb") as src:
+        dst_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src.fileno())
+        finally:
+            os.close(dst_fd)
+
+
+def replace_with_link(source, target, mode):
+    """Atomically replace target with a hardlink to, or a reflink clone of, source.
+
+    The link is created under a temporary name in target's directory and
+    renamed over target, so the path never disappears. A clone keeps the
+    permissions and times of the file it replaces; a hardlink shares them
+    with source.
+    """
+    tmp_path = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.{os.getpid()}.dedupe")
+    try:
+        if mode == "hardlink":
+            os.link(source, tmp_path)
+        else:
+            clone_file(source, tmp_path)
+            st = os.stat(target)
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def file_identity(path):
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def bulk_link(groups, keep, mode, cache=None, progress=None, cancel=None, links=None):
+    """Replace duplicates with hardlinks or reflink clones of one kept file per group.
+
+    Every group is verified by content first (through `cache`, a HashCache,
+    when given) and only byte-identical files are linked; a file changed
+    between verification and linking is skipped. Hardlinks need the kept
+    file on the same filesystem. `links` maps a path to the other paths
+    (hardlinks) of the same file: they are replaced first, with size 0 in
+    the results, since the old file's space is freed only when none of its
+    paths is left; if one of them fails, the file itself is skipped.
+    Returns (results, cancelled) like bulk_delete, with status "linked" for
+    the replaced files.
+    """
+    total = sum(len(items) for items in groups.values())
+    results = []
+    done = 0
+    for name, items in groups.items():
+        if cancel is not None and cancel.is_set():
+            break
+        if os.path.isdir(items[0][1]):
+            continue  # grupa katalogów
+        identities = {}
+        for size, path in items:
+            try:
+                identities[path] = file_identity(path)
+            except OSError as e:
+                results.append(("failed", name, path, "", size, str(e)))
+        for _, same in hashing.split_by_content([item for item in items if item[1] in identities], cache):
+            kept = same[choose_keeper(same, keep)][1]
+            for size, path in same:
+                if path == kept:
+                    continue
+                try:
+                    current = file_identity(path)
+                    if current != identities[path] or file_identity(kept) != identities[kept]:
+                        results.append(("skipped", name, path, kept, size, "changed since verification"))
+                    elif current[:2] == identities[kept][:2]:
+                        results.append(("skipped", name, path, kept, size, "already linked"))
+                    elif mode == "hardlink" and current[0] != identities[kept][0]:
+                        results.append(("skipped", name, path, kept, size, "different filesystem"))
+                    elif not relink_others(name, kept, path, current, mode, (links or {}).get(path, ()), results):
+                        results.append(("skipped", name, path, kept, size, "other hardlinks could not be replaced"))
+                    else:
+                        replace_with_link(kept, path, mode)
+                        results.append(("linked", name, path, kept, size, ""))
+                except OSError as e:
+                    results.append(("failed", name, path, kept, size, str(e)))
+        done += len(items)
+        if progress is not None and done // BATCH_SIZE != (done - len(items)) // BATCH_SIZE:
+            progress(done, total)
+    return results, cancel is not None and cancel.is_set()
+
+
+def relink_others(name, kept, path, identity, mode, others, results):
+    # Przepinamy pozostałe ścieżki tego samego i-węzła; zwraca False, gdy któraś się nie udała
+    replaced = True
+    for link in others:
+        try:
+            if file_identity(link)[:2] != identity[:2]:
+                continue  # ścieżka wskazuje już inny plik
+            replace_with_link(kept, link, mode)
+            results.append(("linked", name, link, kept, 0, ""))
+        except OSError as e:
+            results.append(("failed", name, link, kept, 0, str(e)))
+            replaced = False
+    return replaced
+
+
+def write_log(results, action="deleted"):
+    """Write the results of a bulk action to a CSV file in the cache directory and return its path."""
+    directory = os.path.join(storage.cache_dir(), "logs")
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(directory, f"{action}_{timestamp}.csv")
+    # Nazwy plików niebędące poprawnym UTF-8 zapisujemy jako sekwencje \x.., zamiast przerywać zapis
+    with open(path, "w", newline="", encoding="utf-8", errors="backslashreplace") as log_file:
+        writer = csv.writer(log_file)
+        writer.writerow(["Status", "Group", "Path", "Kept", "Size (B)", "Error"])
+        writer.writerows(results)
+    return path
@@ -0,0 +1,76 @@
+import re
+import random
+import hashlib
+import hash_pool
+from file_table import np
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.rst', '.csv', '.json', '.xml', '.html', '.htm', '.css', '.ini', '.cfg', '.toml',
+                   '.yaml', '.yml', '.py', '.c', '.h', '.cpp', '.hpp', '.java', '.js', '.ts', '.go', '.rs', '.sh',
+                   '.bat', '.ps1', '.sql', '.tex')
+MAX_DOCUMENT_SIZE = 8 * 1024 * 1024  # większe pliki tekstowe to zwykle logi i zrzuty danych - pomijamy
+SHINGLE_SIZE = 5        # ile kolejnych tokenów tworzy jeden fragment (shingle)
+SIGNATURE_SIZE = 128    # liczba funkcji skrótu MinHash
+MINHASH_SEED = 20240601  # stałe ziarno - sygnatury z pamięci podręcznej muszą pasować do nowych
+TOKEN = re.compile(rb"\w+|[^\w\s]")
+MASK = (1 << 64) - 1
+
+# Mnożniki (nieparzyste) i przesunięcia rodziny skrótów (a * x + b) mod 2^64, z której bierzemy górne 32 bity
+_random = random.Random(MINHASH_SEED)
+MULTIPLIERS = [_random.getrandbits(64) | 1 for _ in range(SIGNATURE_SIZE)]
+OFFSETS = [_random.getrandbits(64) for _ in range(SIGNATURE_SIZE)]
+del _random
+
+
+def is_document(path):
+    return path.lower().endswith(TEXT_EXTENSIONS)
+
+
+def shingles(data):
+    """Set of 64-bit hashes of every SHINGLE_SIZE consecutive tokens (words and punctuation) of a text."""
+    tokens = TOKEN.findall(data)
+    if not tokens:
+        return set()
+    width = min(SHINGLE_SIZE, len(tokens))
+    return {int.from_bytes(hashlib.blake2b(b"\0".join(tokens[i:i + width]), digest_size=8).digest(), "little")
+            for i in range(len(tokens) - width + 1)}
+
+
+def minhash(values):
+    """MinHash signature (SIGNATURE_SIZE 32-bit minima) of a non-empty set of 64-bit shingle hashes."""
+    if np is not None:
+        hashes = np.fromiter(values, dtype=np.uint64, count=len(values))
+        signature = np.empty(SIGNATURE_SIZE, dtype=np.uint64)
+        multipliers = np.array(MULTIPLIERS, dtype=np.uint64)
+        offsets = np.array(OFFSETS, dtype=np.uint64)
+        # Mnożenie uint64 przekręca się modulo 2^64 - dokładnie tak jak w wersji bez NumPy
+        with np.errstate(over="ignore"):
+            for i in range(SIGNATURE_SIZE):
+                signature[i] = ((hashes * multipliers[i] + offsets[i]) >> np.uint64(32)).min()
+        return signature.tolist()
+    return [min(((a * x + b) & MASK) >> 32 for x in values) for a, b in zip(MULTIPLIERS, OFFSETS)]
+
+
+def document_signature(path):
+    # Wykonywane w procesie puli; sygnaturę zapisujemy jako tekst (8 cyfr szesnastkowych na wartość)
+    try:
+        with open(path, "rb") as f:
+            data = f.read(MAX_DOCUMENT_SIZE + 1)
+    except OSError:
+        return path, None
+    if len(data) > MAX_DOCUMENT_SIZE or b"\0" in data[:8192]:
+        return path, ""  # plik binarny albo za duży - zapamiętujemy, żeby nie czytać go ponownie
+    values = shingles(data)
+    return path, "".join(f"{value:08x}" for value in minhash(values)) if values else ""
+
+
+def document_signatures(items, cache=None, cancel=None, workers=hash_pool.DEFAULT_WORKERS):
+    """Return {path: MinHash signature} for the text files among (size, path) items.
+
+    Signatures are computed in a process pool and kept in `cache` (a
+    hashing.HashCache), so only new or changed files are read. Empty,
+    binary and oversized files are left out.
+    """
+    paths = [path for size, path in items if is_document(path) and size <= MAX_DOCUMENT_SIZE]
+    found = hash_pool.cached_hashes(paths, "minhash", document_signature, cache, cancel, workers, chunksize=16)
+    return {path: [int(value[i:i + 8], 16) for i in range(0, len(value), 8)]
+            for path, value in found.items() if value}
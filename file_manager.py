@@ -1,13 +1,28 @@
 import os
 import csv
-import cv2
 import datetime
 import tkinter as tk
 import subprocess
 import sys
-from tkinter import filedialog, ttk, font as tkfont
-from PIL import Image, ImageTk
-from collections import defaultdict
+import time
+import functools
+import queue
+import threading
+from tkinter import filedialog, messagebox, ttk, font as tkfont
+from PIL import ImageTk
+from concurrent.futures import ThreadPoolExecutor
+import dedupe
+import documents
+import grouping
+import hashing
+import hash_pool
+import name_rules
+import scanner
+import thumbnails
+
+SCAN_POLL_MS = 100  # co ile ms sprawdzamy kolejkę wątku skanującego
+PREVIEW_POLL_MS = 50  # co ile ms odbieramy gotowe miniatury
+PREVIEW_WORKERS = 4  # ile miniatur dekodujemy równocześnie
 
 def open_location(p):
     try:
@@ -69,38 +84,29 @@ def create_action_buttons(frame, path):
                            command=lambda p=path: run_file(p))
     run_button.pack(side=tk.LEFT, padx=2)
 
-def display_file(file_path, frame, thumbnail_size):
+def display_file(file_path, frame, thumbnail_size, app):
     preview_frame = tk.Frame(frame, width=thumbnail_size, height=thumbnail_size)
     preview_frame.pack(pady=5)
     
-    if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
-        try:
-            image = Image.open(file_path)
-            image.thumbnail((thumbnail_size, thumbnail_size))
+    if thumbnails.is_image(file_path) or thumbnails.is_video(file_path):
+        # Miniatura już w pamięci - pokazujemy od razu
+        image = app.thumbnail_cache.peek(file_path, thumbnail_size)
+        if image is not None:
             img = ImageTk.PhotoImage(image)
             lbl = tk.Label(preview_frame, image=img)
             lbl.image = img
             lbl.pack()
-        except Exception as e:
-            error_label = tk.Label(preview_frame, text="Error loading image")
-            error_label.pack()
-    
-    elif file_path.lower().endswith('.mp4'):
-        try:
-            cap = cv2.VideoCapture(file_path)
-            ret, frame_img = cap.read()
-            if ret:
-                frame_img = cv2.cvtColor(frame_img, cv2.COLOR_BGR2RGB)
-                image = Image.fromarray(frame_img)
-                image.thumbnail((thumbnail_size, thumbnail_size))
-                img = ImageTk.PhotoImage(image)
-                lbl = tk.Label(preview_frame, image=img)
-                lbl.image = img
-                lbl.pack()
-            cap.release()
-        except Exception as e:
-            error_label = tk.Label(preview_frame, text="Error loading video")
-            error_label.pack()
+            return
+
+        # W przeciwnym razie dekodujemy w tle, a do tego czasu pokazujemy zaślepkę
+        lbl = tk.Label(preview_frame, text="Loading...",
+                       width=thumbnail_size//10,
+                       height=thumbnail_size//20)
+        lbl.pack()
+        generation = app.preview_generation
+        future = app.preview_pool.submit(app.thumbnail_cache.get, file_path, thumbnail_size)
+        future.add_done_callback(lambda f: app.preview_results.put((generation, file_path, lbl, f)))
+        app.preview_futures.append(future)
     else:
         file_ext = os.path.splitext(file_path)[1]
         type_label = tk.Label(preview_frame, 
@@ -109,6 +115,31 @@ def display_file(file_path, frame, thumbnail_size):
                             height=thumbnail_size//20)
         type_label.pack(expand=True)
 
+def start_preview_generation(app):
+    # Nowa grupa na ekranie - wyniki dla poprzednich grup będą odrzucane
+    app.preview_generation += 1
+    for future in app.preview_futures:
+        future.cancel()
+    app.preview_futures = []
+
+def poll_previews(app):
+    # Podmieniamy zaślepki na gotowe miniatury (PhotoImage tylko w wątku Tk)
+    while True:
+        try:
+            generation, file_path, lbl, future = app.preview_results.get_nowait()
+        except queue.Empty:
+            break
+        if generation != app.preview_generation or future.cancelled() or not lbl.winfo_exists():
+            continue
+        try:
+            img = ImageTk.PhotoImage(future.result())
+            lbl.config(image=img, text="", width=0, height=0)
+            lbl.image = img
+        except Exception:
+            kind = "image" if thumbnails.is_image(file_path) else "video"
+            lbl.config(text=f"Error loading {kind}")
+    app.root.after(PREVIEW_POLL_MS, lambda: poll_previews(app))
+
 def create_delete_button(frame, path, name, app):
     delete_button = tk.Button(frame, text="Delete", bg="#ff9999", 
                               command=lambda p=path, f=frame, n=name: delete_file(app, p, f, n))
@@ -120,6 +151,8 @@ def format_size(size):
 
 
 def scan_directory(app):
+    if is_scanning(app):
+        return
     update_info_label(app, "Selecting directory: .....", "blue")
     folder = filedialog.askdirectory()  # Otwieramy okno dialogowe wyboru katalogu
     if not folder:
@@ -135,13 +168,12 @@ def refresh_app(app):
         update_info_label(app, "No directory selected.", "red")
         return
 
-    # Resetujemy dane aplikacji
-    app.file_data = {}
+    # Przetwarzamy katalog w tle, resztę robimy po zakończeniu skanowania
+    process_directory(app, on_done=finish_refresh)
+
+def finish_refresh(app):
     app.current_index = 0
-    
-    # Przetwarzamy katalog
-    process_directory(app)
-    
+
     # Odświeżamy listę 
     refresh_list(app)
     
@@ -153,63 +185,387 @@ def refresh_app(app):
 
 def update_info_label(app, text, color):
     app.info_label.config(text=text, fg=color)
-    app.root.update()  # Odświeżamy UI
-
-def scan_files(folder):
-    file_info = []  # Lista krotek (nazwa, rozmiar, ścieżka)
-    for root, _, files in os.walk(folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                size = os.path.getsize(file_path)
-                file_info.append((file, size, file_path))
-            except OSError:
-                print(f'Błąd dostępu do pliku: {file_path}')
-    return file_info
-
-def filter_files(app, file_info):
-    filtered_files = {}
-    if app.compare_by_name.get() and app.compare_by_size.get():
-        file_dict = defaultdict(list)
-        for name, size, path in file_info:
-            key = (name, size)
-            file_dict[key].append((size, path))
-        for (name, size), items in file_dict.items():
-            if len(items) > 1:
-                display_name = f"{name} ({size} bytes)"
-                filtered_files[display_name] = items
-    elif app.compare_by_size.get():
-        file_dict = defaultdict(list)
-        for name, size, path in file_info:
-            file_dict[size].append((size, path))
-        for size, items in file_dict.items():
-            if len(items) > 1:
-                display_name = f"Size: {size} bytes ({len(items)} files)"
-                filtered_files[display_name] = items
-    elif app.compare_by_name.get():
-        file_dict = defaultdict(list)
-        for name, size, path in file_info:
-            file_dict[name].append((size, path))
-        for name, items in file_dict.items():
-            if len(items) > 1:
-                filtered_files[name] = sorted(items, key=lambda x: -x[0])
-    else:
+
+def scan_files(folder, workers=scanner.DEFAULT_WORKERS, use_index=False, progress=None, cancel=None):
+    # Kolumnowa tabela plików (iteracja daje krotki (nazwa, rozmiar, ścieżka)), katalogi skanowane równolegle.
+    # Z indeksem niezmienione katalogi (to samo mtime) są brane z dysku podręcznego
+    return scanner.scan_tree(folder, workers, use_index, progress, cancel)
+
+def get_criteria(app):
+    # Odczytujemy pola wyboru w wątku Tk, wątek skanujący dostaje zwykły słownik
+    if not any_criteria(app):
         app.compare_by_name.set(True)
-        return filter_files(app, file_info)
-    return filtered_files
+    return {
+        "name": app.compare_by_name.get(),
+        "size": app.compare_by_size.get(),
+        "content": app.compare_by_content.get(),
+        "video": app.compare_by_video.get(),
+        "similar": app.compare_by_similar.get(),
+        "similar_video": app.compare_by_similar_video.get(),
+        "name_key": app.name_normalizer if app.ignore_copy_suffixes.get() else None,
+        "video_key": functools.partial(video_key, app.video_info),
+        "similar_docs": app.compare_by_similar_docs.get(),
+        "directories": app.group_directories.get(),
+        "image_hashes": functools.partial(cached_signatures, thumbnails.image_hashes),
+        "video_fingerprints": functools.partial(cached_signatures, thumbnails.video_fingerprints),
+        "document_signatures": functools.partial(cached_signatures, documents.document_signatures),
+    }
+
+def any_criteria(app):
+    return any(variable.get() for variable in (app.compare_by_name, app.compare_by_size, app.compare_by_content,
+                                               app.compare_by_video, app.compare_by_similar,
+                                               app.compare_by_similar_video, app.compare_by_similar_docs))
+
+def cached_signatures(compute, items, cancel):
+    # Skróty percepcyjne i sygnatury MinHash z pamięci podręcznej (w wątku, który ją otworzył), brakujące liczone w puli procesów
+    cache = hashing.open_cache()
+    try:
+        return compute(items, cache, cancel)
+    finally:
+        if cache:
+            cache.close()
+
+def video_key(video_info, path):
+    # Klucz porównania filmów z pamięci podręcznej metadanych, None dla innych plików
+    if not thumbnails.is_video(path):
+        return None
+    return thumbnails.comparison_key(video_info.get(path))
+
+def filter_files(criteria, file_info, cancel=None, cache=None, pool=None):
+    # Grupowanie odbywa się na indeksach nazw i rozmiarów, budowanych raz po skanowaniu
+    if not isinstance(file_info, grouping.FileIndex):
+        file_info = grouping.FileIndex(file_info)
+    return file_info.group(criteria, cancel, cache, pool)
+
+def get_scan_workers(app):
+    try:
+        return max(1, app.scan_workers.get())
+    except tk.TclError:
+        # Niepoprawna wartość w polu - wracamy do domyślnej
+        app.scan_workers.set(scanner.DEFAULT_WORKERS)
+        return scanner.DEFAULT_WORKERS
 
 def update_file_data(app, filtered_files):
     app.file_data = filtered_files
+    app.groups_with_deletions = set()
     if app.file_data:
-        update_info_label(app, f"Found {len(app.file_data)} groups of duplicate files.", "green")
+        update_info_label(app, f"Found {len(app.file_data)} groups of duplicate files. {app.cache_stats}", "green")
     else:
         update_info_label(app, "No duplicate files found with current criteria.", "blue")
 
-def process_directory(app):
-    update_info_label(app, f"Scanning directory: {app.current_directory}...", "blue")
-    file_info = scan_files(app.current_directory)
-    filtered_files = filter_files(app, file_info)
-    update_file_data(app, filtered_files)
+def scan_worker(folder, criteria, workers, use_index, messages, cancel):
+    # Działa poza wątkiem Tk - z UI rozmawiamy wyłącznie przez kolejkę
+    file_info = scan_files(folder, workers, use_index,
+                           progress=lambda *stats: messages.put(("progress", stats)),
+                           cancel=cancel)
+    messages.put(("status", f"Grouping {len(file_info):,} files..."))
+    file_index = grouping.FileIndex(file_info)
+    return file_index, group_worker(file_index, criteria, messages, cancel)
+
+def group_worker(file_index, criteria, messages, cancel):
+    if not criteria["content"]:
+        return filter_files(criteria, file_index, cancel)
+    cache = hashing.open_cache()
+    try:
+        with open_hash_pool(cache, messages, cancel) as pool:
+            filtered_files = filter_files(criteria, file_index, cancel, cache, pool)
+            messages.put(("stats", hash_stats(cache, pool)))
+        return filtered_files
+    finally:
+        if cache:
+            cache.close()
+
+def open_hash_pool(cache, messages, cancel):
+    # Skróty liczone w procesach; postęp i MB/s na urządzenie trafiają do paska stanu
+    return hash_pool.HashPool(cache=cache, cancel=cancel, progress=lambda text: messages.put(("status", text)))
+
+def hash_stats(cache, pool):
+    return " ".join(text for text in (cache.stats_text() if cache else "", pool.stats_text()) if text)
+
+def verify_worker(groups, file_index, messages, cancel):
+    # Sprawdzamy bajt po bajcie (przez skróty), czy pliki w grupach są naprawdę identyczne
+    cache = hashing.open_cache()
+    try:
+        folders = {name for name, items in groups.items() if os.path.isdir(items[0][1])}
+        groups = {name: items for name, items in groups.items() if name not in folders}
+        with open_hash_pool(cache, messages, cancel) as pool:
+            verified = {}
+            if folders and file_index is not None:
+                # Grupy katalogów mogły powstać z samych nazw i rozmiarów - wyznaczamy je od nowa po zawartości
+                verified, _ = file_index.directory_groups({"content": True}, cancel, cache, pool)
+            split = pool.split_groups(list(groups.values()))
+            for name, parts in zip(groups, split):
+                for digest, duplicates in parts:
+                    display_name = f"{name} [{digest[:8]}]" if len(parts) > 1 else name
+                    verified[display_name] = duplicates
+            if cache:
+                cache.compact()
+            messages.put(("stats", hash_stats(cache, pool)))
+        return verified
+    finally:
+        if cache:
+            cache.close()
+
+def is_scanning(app):
+    return app.scan_thread is not None and app.scan_thread.is_alive()
+
+def run_in_background(app, target, args, on_done, status):
+    # Uruchamia target(*args, messages, cancel) w osobnym wątku, wynik trafia do on_done(app, wynik)
+    if is_scanning(app):
+        return
+    update_info_label(app, status, "blue")
+    app.scan_cancel = threading.Event()
+    app.scan_messages = queue.Queue()
+    app.scan_started = time.monotonic()
+    app.cache_stats = ""
+
+    def worker():
+        try:
+            app.scan_messages.put(("done", target(*args, app.scan_messages, app.scan_cancel)))
+        except scanner.ScanCancelled:
+            app.scan_messages.put(("cancelled", None))
+        except Exception as e:
+            app.scan_messages.put(("error", str(e)))
+
+    app.scan_thread = threading.Thread(target=worker, daemon=True)
+    app.scan_thread.start()
+    set_scan_controls(app, scanning=True)
+    app.root.after(SCAN_POLL_MS, lambda: poll_scan(app, on_done))
+
+def process_directory(app, on_done=None):
+    def scan_done(app, result):
+        app.file_index, filtered_files = result
+        update_file_data(app, filtered_files)
+        if on_done:
+            on_done(app)
+
+    run_in_background(app, scan_worker,
+                      (app.current_directory, get_criteria(app), get_scan_workers(app), app.use_scan_index.get()),
+                      scan_done, f"Scanning directory: {app.current_directory}...")
+
+def regroup(app):
+    # Zmiana kryteriów - grupujemy ponownie z indeksów w pamięci, bez skanowania dysku
+    if app.file_index is None:
+        return
+    if is_scanning(app):
+        app.regroup_pending = True
+        return
+    if not any_criteria(app):
+        app.compare_by_name.set(True)  # wywoła regroup ponownie przez trace
+        return
+    criteria = get_criteria(app)
+
+    def regroup_done(app, filtered_files):
+        update_file_data(app, filtered_files)
+        finish_refresh(app)
+
+    if (criteria["content"] or criteria["video"] or criteria["similar"] or criteria["similar_video"]
+            or criteria["similar_docs"] or criteria["directories"]):
+        # Te tryby czytają pliki (przez pamięć podręczną), więc działają w tle
+        run_in_background(app, group_worker, (app.file_index, criteria), regroup_done, "Regrouping files...")
+    else:
+        app.cache_stats = ""
+        regroup_done(app, filter_files(criteria, app.file_index))
+
+def verify_groups(app):
+    if not app.file_data:
+        update_info_label(app, "Nothing to verify.", "red")
+        return
+
+    def verify_done(app, verified):
+        checked = len(app.file_data)
+        app.file_data = verified
+        finish_refresh(app)
+        update_info_label(app, f"Verified {checked:,} groups: {len(verified):,} groups of identical files. "
+                               f"{app.cache_stats}", "green")
+
+    run_in_background(app, verify_worker, (dict(app.file_data), app.file_index), verify_done,
+                      "Verifying group contents...")
+
+def bulk_delete_worker(groups, keep, links, messages, cancel):
+    # Grupy z trybów innych niż zawartość nie muszą zawierać identycznych plików - sprawdzamy je przed usunięciem
+    cache = hashing.open_cache()
+    try:
+        results, cancelled = dedupe.bulk_delete(
+            groups, keep, cache,
+            progress=lambda done, total: messages.put(("status", f"Deleting: {done:,} of {total:,} files...")),
+            cancel=cancel, links=links)
+    finally:
+        if cache:
+            cache.close()
+    try:
+        log_path = dedupe.write_log(results)
+    except (OSError, ValueError) as e:
+        # Pliki są już usunięte - wynik musi trafić do UI nawet bez dziennika
+        print(f'Błąd zapisu dziennika usuwania: {e}')
+        log_path = None
+    return results, cancelled, log_path
+
+def bulk_delete(app):
+    if not app.file_data:
+        update_info_label(app, "Nothing to delete.", "red")
+        return
+    keep = app.keep_rule.get()
+    groups = {name: items for name, items in app.file_data.items() if len(items) > 1}
+    count = sum(len(items) - 1 for items in groups.values())
+    if not messagebox.askyesno("Delete Duplicates",
+                               f"Verify {len(groups):,} groups by content, keep the {keep} of each set of "
+                               f"identical files and delete up to {count:,} files?"):
+        return
+
+    def bulk_delete_done(app, result):
+        results, cancelled, log_path = result
+        deleted = {path: size for status, _, path, _, size, _ in results if status == "deleted"}
+        failed = sum(1 for status, *_ in results if status != "deleted")
+        # Jedna aktualizacja danych, indeksu i listy na koniec całej operacji
+        app.deleted_files.update(deleted)
+        if app.file_index is not None:
+            app.file_index.remove_many(deleted)
+        for name in groups:
+            remaining = [(size, path) for size, path in app.file_data.get(name, []) if path not in deleted]
+            if len(remaining) > 1:
+                app.file_data[name] = remaining
+                if len(remaining) < len(groups[name]):
+                    app.groups_with_deletions.add(name)
+            else:
+                app.file_data.pop(name, None)
+        finish_refresh(app)
+        text = f"Deleted {len(deleted):,} files ({format_size(sum(deleted.values()))}), {failed:,} failed or skipped."
+        if cancelled:
+            text = f"Cancelled. {text}"
+        if log_path:
+            text += f" Log: {log_path}"
+        update_info_label(app, text, "red" if failed or cancelled else "green")
+
+    # Usuwany plik znika razem ze wszystkimi dowiązaniami, inaczej miejsce nie zostałoby zwolnione
+    links = {}
+    if app.file_index is not None:
+        links = {path: app.file_index.link_paths(path) for items in groups.values() for _, path in items}
+    run_in_background(app, bulk_delete_worker, (groups, keep, links), bulk_delete_done, f"Deleting {count:,} files...")
+
+def bulk_link_worker(groups, keep, mode, links, messages, cancel):
+    cache = hashing.open_cache()
+    try:
+        results, cancelled = dedupe.bulk_link(
+            groups, keep, mode, cache,
+            progress=lambda done, total: messages.put(("status", f"Linking: {done:,} of {total:,} files...")),
+            cancel=cancel, links=links)
+    finally:
+        if cache:
+            cache.close()
+    try:
+        log_path = dedupe.write_log(results, action=mode)
+    except (OSError, ValueError) as e:
+        print(f'Błąd zapisu dziennika: {e}')
+        log_path = None
+    return results, cancelled, log_path
+
+def bulk_link(app, mode):
+    if not app.file_data:
+        update_info_label(app, "Nothing to link.", "red")
+        return
+    keep = app.keep_rule.get()
+    groups = {name: items for name, items in app.file_data.items() if len(items) > 1}
+    if not messagebox.askyesno("Replace Duplicates",
+                               f"Verify {len(groups):,} groups by content and replace the duplicates "
+                               f"with {mode}s to the {keep} file?"):
+        return
+
+    def bulk_link_done(app, result):
+        results, cancelled, log_path = result
+        linked = [size for status, _, _, _, size, _ in results if status == "linked"]
+        if app.file_index is not None:
+            # Nowe i-węzły połączonych plików - inaczej po zmianie kryteriów wróciłyby jako duplikaty
+            app.file_index.restat([path for status, _, path, *_ in results if status == "linked"])
+        # Ścieżki zostają na miejscu - z listy znika tylko grupa, w której wszystko poza jednym zachowanym
+        # plikiem zostało połączone; grupy z plikami o innej treści, błędami lub pominięciami są oznaczone
+        linked_paths = {}
+        kept_paths = {}
+        for status, name, path, kept, _, error in results:
+            kept_paths.setdefault(name, set()).add(kept)
+            if status == "linked" or (status == "skipped" and error == "already linked"):
+                linked_paths.setdefault(name, set()).add(path)
+        for name, items in groups.items():
+            if os.path.isdir(items[0][1]) or (cancelled and name not in kept_paths):
+                continue  # grupy katalogów nie są łączone; po przerwaniu nie wiemy, czy grupę sprawdzono
+            if len(kept_paths.get(name, ())) == 1 and all(path in linked_paths.get(name, ()) or path in kept_paths[name]
+                                                  for _, path in items):
+                app.file_data.pop(name, None)
+            else:
+                app.groups_with_deletions.add(name)
+        finish_refresh(app)
+        failed = sum(1 for status, *_ in results if status not in ("linked", "skipped"))
+        text = f"Replaced {len(linked):,} files with {mode}s ({format_size(sum(linked))} reclaimed), {failed:,} failed."
+        if cancelled:
+            text = f"Cancelled. {text}"
+        if log_path:
+            text += f" Log: {log_path}"
+        update_info_label(app, text, "red" if failed or cancelled else "green")
+
+    # Plik zwalnia miejsce dopiero, gdy przepniemy wszystkie jego dowiązania twarde
+    links = {}
+    if app.file_index is not None:
+        links = {path: app.file_index.link_paths(path) for items in groups.values() for _, path in items}
+    run_in_background(app, bulk_link_worker, (groups, keep, mode, links), bulk_link_done,
+                      f"Replacing duplicates with {mode}s...")
+
+def poll_scan(app, on_done):
+    # Odbieramy komunikaty z wątku skanującego
+    while True:
+        try:
+            kind, payload = app.scan_messages.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "progress":
+            files, dirs, bytes_seen = payload
+            elapsed = max(time.monotonic() - app.scan_started, 1e-6)
+            update_info_label(app, f"Scanning: {files:,} files ({files / elapsed:,.0f} files/s), "
+                                   f"{dirs:,} dirs, {format_size(bytes_seen)}", "blue")
+        elif kind == "status":
+            update_info_label(app, payload, "blue")
+        elif kind == "stats":
+            app.cache_stats = payload
+        elif kind == "done":
+            set_scan_controls(app, scanning=False)
+            on_done(app, payload)
+            run_pending_regroup(app)
+            return
+        elif kind == "cancelled":
+            set_scan_controls(app, scanning=False)
+            update_info_label(app, "Scan cancelled.", "red")
+            run_pending_regroup(app)
+            return
+        elif kind == "error":
+            set_scan_controls(app, scanning=False)
+            update_info_label(app, f"Scan failed: {payload}", "red")
+            run_pending_regroup(app)
+            return
+    app.root.after(SCAN_POLL_MS, lambda: poll_scan(app, on_done))
+
+def run_pending_regroup(app):
+    # Wątek mógł jeszcze nie zakończyć się po wysłaniu wyniku - czekamy, aż regroup będzie mógł ruszyć
+    if not app.regroup_pending:
+        return
+    if is_scanning(app):
+        app.root.after(SCAN_POLL_MS, lambda: run_pending_regroup(app))
+        return
+    app.regroup_pending = False
+    regroup(app)
+
+def cancel_scan(app):
+    if is_scanning(app):
+        app.scan_cancel.set()
+        update_info_label(app, "Cancelling scan...", "red")
+
+def set_scan_controls(app, scanning):
+    state = tk.DISABLED if scanning else tk.NORMAL
+    app.load_button.config(state=state)
+    app.refresh_button.config(state=state)
+    app.verify_button.config(state=state)
+    app.delete_button.config(state=state)
+    app.hardlink_button.config(state=state)
+    app.reflink_button.config(state=state)
+    app.cancel_button.config(state=tk.NORMAL if scanning else tk.DISABLED)
 
 def refresh_list(app):
     # Zachowujemy bieżący wybór
@@ -219,8 +575,9 @@ def refresh_list(app):
     else:
         current_selection = 0
 
-    # Czyścimy listę
-    app.file_listbox.delete(0, tk.END) # Usuwamy wszystkie elementy z listboxa
+    # Lista nazw grup - widżet rysuje tylko widoczne wiersze
+    app.group_names = list(app.file_data.keys())
+    app.file_listbox.set_items(app.group_names)
     
     # Sprawdzamy czy są dane
     if not app.file_data:
@@ -230,28 +587,19 @@ def refresh_list(app):
         app.info_label.config(text="No duplicate files found with current criteria.")
         return
     
-    # Wypełniamy listę
-    for i, name in enumerate(app.file_data.keys()):
-        app.file_listbox.insert(tk.END, name)
-        files_for_name = [path for _, path in app.file_data[name]]
-        has_deleted = any(path in app.deleted_files for path in files_for_name)
-        if has_deleted:
-            app.file_listbox.itemconfig(i, fg="red")
-    
     # Wybieramy element
-    if app.file_listbox.size() > 0:
-        if current_selection >= app.file_listbox.size():
-            current_selection = app.file_listbox.size() - 1
-        app.file_listbox.selection_set(current_selection)
-        app.current_index = current_selection
-
-def select_file(app, event):
-    selection = app.file_listbox.curselection()
-    if selection:
-        app.current_index = selection[0]
-        show_comparison(app)
+    if current_selection >= app.file_listbox.size():
+        current_selection = app.file_listbox.size() - 1
+    app.file_listbox.selection_set(current_selection)
+    app.current_index = current_selection
+
+def select_file(app, index):
+    app.current_index = index
+    show_comparison(app)
 
 def show_comparison(app):
+    start_preview_generation(app)
+
     # Czyścimy ramkę canvas
     for widget in app.canvas_frame.winfo_children():
         widget.destroy()
@@ -265,7 +613,7 @@ def show_comparison(app):
         return
     
     # Sprawdzamy czy indeks jest prawidłowy
-    if app.current_index >= len(list(app.file_data.keys())):
+    if app.current_index >= len(app.group_names):
         if len(app.file_data) > 0:
             app.current_index = 0
         else:
@@ -274,7 +622,8 @@ def show_comparison(app):
             return
     
     # Pobieramy dane dla bieżącego indeksu
-    name, files = list(app.file_data.items())[app.current_index]
+    name = app.group_names[app.current_index]
+    files = app.file_data[name]
     num_files = len(files)
     
     # Obliczamy rozmiar miniaturki
@@ -314,9 +663,15 @@ def create_paths_frame(app, files, thumbnail_size):
         path_frame = tk.Frame(paths_frame, width=thumbnail_size, height=(0.5 * thumbnail_size))
         path_frame.grid(row=0, column=i, padx=0, pady=10)
         formatted_size = format_size(size)
-        info_label = tk.Label(path_frame, text=f"Found_{i+1}\nSize: {formatted_size}", wraplength=thumbnail_size)
+        # Dowiązania twarde to jeden plik - pokazujemy wszystkie jego ścieżki razem
+        links = app.file_index.link_paths(path) if app.file_index is not None else []
+        info_text = f"Found_{i+1}\nSize: {formatted_size}"
+        if links:
+            info_text += f"\nHardlinked: {len(links) + 1} paths"
+        info_label = tk.Label(path_frame, text=info_text, wraplength=thumbnail_size)
         info_label.pack(fill=tk.X)
-        path_label = tk.Label(path_frame, text=f"Path: {path}", wraplength=thumbnail_size, justify=tk.LEFT, anchor="w")
+        path_text = "\n".join([f"Path: {path}"] + [f"Link: {link}" for link in links])
+        path_label = tk.Label(path_frame, text=path_text, wraplength=thumbnail_size, justify=tk.LEFT, anchor="w")
         path_label.pack(fill=tk.X)
 
 def create_actions_frame(app, files, thumbnail_size, name):
@@ -327,20 +682,20 @@ def create_actions_frame(app, files, thumbnail_size, name):
         frame = tk.Frame(actions_frame)
         frame.pack(side=tk.LEFT, padx=10, pady=10)
         create_action_buttons(frame, path)
-        display_file(path, frame, thumbnail_size)
-        create_delete_button(frame, path, name, app)
+        display_file(path, frame, thumbnail_size, app)
+        if not os.path.isdir(path):  # katalogów nie usuwamy pojedynczym przyciskiem
+            create_delete_button(frame, path, name, app)
 
 def delete_file(app, file_path, frame, file_name):
     try:
         os.remove(file_path)
         app.deleted_files.add(file_path)
+        app.groups_with_deletions.add(file_name)
+        if app.file_index is not None:
+            app.file_index.remove(file_path)
         frame.destroy()
         app.info_label.config(text=f"Deleted: {file_path}", fg="green")
-        
-        names = list(app.file_data.keys())
-        if file_name in names:
-            idx = names.index(file_name)
-            app.file_listbox.itemconfig(idx, fg="red")
+        app.file_listbox.redraw()
         
         remaining_files = [(size, path) for size, path in app.file_data[file_name] if path != file_path]
         if remaining_files:
@@ -355,6 +710,108 @@ def delete_file(app, file_path, frame, file_name):
 
 
 
+class VirtualListbox(tk.Frame):
+    """Listbox that only creates rows for the visible part of a long list.
+
+    The items live in a plain Python list; scrolling refills the few rows of
+    the inner tk.Listbox, so the cost does not depend on the number of groups.
+    Rows for which is_marked(item) is true are drawn in red.
+    """
+
+    def __init__(self, master, on_select, is_marked, height, width, font):
+        super().__init__(master)
+        self.on_select = on_select
+        self.is_marked = is_marked
+        self.items = []
+        self.top = 0
+        self.rows = height
+        self.selected = None
+
+        self.listbox = tk.Listbox(self, height=height, width=width, font=font, exportselection=False)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.Y, expand=True)
+        self.line_height = tkfont.Font(font=font).metrics("linespace") + 1
+
+        self.listbox.bind("<<ListboxSelect>>", self.on_listbox_select)
+        self.listbox.bind("<Configure>", self.on_resize)
+        self.listbox.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1) or "break")
+        self.listbox.bind("<Button-4>", lambda event: self.scroll(-1) or "break")
+        self.listbox.bind("<Button-5>", lambda event: self.scroll(1) or "break")
+        self.listbox.bind("<Up>", lambda event: self.move_selection(-1) or "break")
+        self.listbox.bind("<Down>", lambda event: self.move_selection(1) or "break")
+        self.listbox.bind("<Prior>", lambda event: self.move_selection(-self.rows) or "break")
+        self.listbox.bind("<Next>", lambda event: self.move_selection(self.rows) or "break")
+
+    def set_items(self, items):
+        self.items = items
+        self.top = 0
+        self.selected = None
+        self.redraw()
+
+    def size(self):
+        return len(self.items)
+
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def selection_set(self, index):
+        self.selected = index
+        self.see(index)
+
+    def see(self, index):
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.rows:
+            self.top = index - self.rows + 1
+        self.redraw()
+
+    def scroll(self, lines):
+        self.top = max(0, min(self.top + lines, len(self.items) - self.rows))
+        self.redraw()
+
+    def move_selection(self, step):
+        if not self.items:
+            return
+        index = 0 if self.selected is None else max(0, min(self.selected + step, len(self.items) - 1))
+        self.selection_set(index)
+        self.on_select(index)
+
+    def redraw(self):
+        # Wypełniamy tylko widoczne wiersze
+        self.top = max(0, min(self.top, len(self.items) - self.rows))
+        visible = self.items[self.top:self.top + self.rows]
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *visible)
+        for row, item in enumerate(visible):
+            if self.is_marked(item):
+                self.listbox.itemconfig(row, fg="red")
+        if self.selected is not None and self.top <= self.selected < self.top + self.rows:
+            self.listbox.selection_set(self.selected - self.top)
+        if self.items:
+            self.scrollbar.set(self.top / len(self.items), min(1.0, (self.top + self.rows) / len(self.items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.items))
+            self.redraw()
+        elif action == "scroll":
+            self.scroll(int(amount) * (self.rows if unit == "pages" else 1))
+
+    def on_listbox_select(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected = self.top + selection[0]
+            self.on_select(self.selected)
+
+    def on_resize(self, event):
+        rows = max(1, event.height // self.line_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.redraw()
+
 def setup_controls_frame(app):
     # Tworzymy ramkę kontrolną
     app.control_frame = tk.Frame(app.root)
@@ -367,17 +824,68 @@ def setup_controls_frame(app):
     # Dodajemy pola wyboru
     app.compare_name_check = tk.Checkbutton(app.control_frame, text="Compare by Name", variable=app.compare_by_name)
     app.compare_name_check.pack(pady=2)
+    app.copy_suffix_check = tk.Checkbutton(app.control_frame, text="Ignore Copy Suffixes",
+                                           variable=app.ignore_copy_suffixes)
+    app.copy_suffix_check.pack(pady=2)
+    app.directories_check = tk.Checkbutton(app.control_frame, text="Duplicate Folders", variable=app.group_directories)
+    app.directories_check.pack(pady=2)
     app.compare_size_check = tk.Checkbutton(app.control_frame, text="Compare by Size", variable=app.compare_by_size)
     app.compare_size_check.pack(pady=2)
+    app.compare_content_check = tk.Checkbutton(app.control_frame, text="Compare by Content", variable=app.compare_by_content)
+    app.compare_content_check.pack(pady=2)
+    app.compare_video_check = tk.Checkbutton(app.control_frame, text="Compare by Video Info", variable=app.compare_by_video)
+    app.compare_video_check.pack(pady=2)
+    app.compare_similar_check = tk.Checkbutton(app.control_frame, text="Similar Images", variable=app.compare_by_similar)
+    app.compare_similar_check.pack(pady=2)
+    app.compare_similar_video_check = tk.Checkbutton(app.control_frame, text="Similar Videos",
+                                                     variable=app.compare_by_similar_video)
+    app.compare_similar_video_check.pack(pady=2)
+    app.compare_similar_docs_check = tk.Checkbutton(app.control_frame, text="Similar Documents",
+                                                    variable=app.compare_by_similar_docs)
+    app.compare_similar_docs_check.pack(pady=2)
+
+    app.scan_index_check = tk.Checkbutton(app.control_frame, text="Use Scan Index", variable=app.use_scan_index)
+    app.scan_index_check.pack(pady=2)
+
+    # Liczba wątków skanujących
+    workers_frame = tk.Frame(app.control_frame)
+    workers_frame.pack(pady=2)
+    tk.Label(workers_frame, text="Scan threads:").pack(side=tk.LEFT)
+    app.scan_workers_spinbox = tk.Spinbox(workers_frame, from_=1, to=128, width=4, textvariable=app.scan_workers)
+    app.scan_workers_spinbox.pack(side=tk.LEFT)
 
     # Dodajemy przycisk do odświeżania
     app.refresh_button = tk.Button(app.control_frame, text="Refresh", command=lambda: refresh_app(app))
     app.refresh_button.pack(pady=5)
 
+    # Weryfikacja zawartości znalezionych grup
+    app.verify_button = tk.Button(app.control_frame, text="Verify Groups", command=lambda: verify_groups(app))
+    app.verify_button.pack(pady=5)
+
+    # Usuwanie duplikatów we wszystkich grupach naraz
+    keep_frame = tk.Frame(app.control_frame)
+    keep_frame.pack(pady=2)
+    tk.Label(keep_frame, text="Keep:").pack(side=tk.LEFT)
+    tk.OptionMenu(keep_frame, app.keep_rule, *dedupe.KEEP_RULES).pack(side=tk.LEFT)
+    app.delete_button = tk.Button(app.control_frame, text="Delete Duplicates", bg="#ff9999",
+                                  command=lambda: bulk_delete(app))
+    app.delete_button.pack(pady=5)
+    app.hardlink_button = tk.Button(app.control_frame, text="Replace with Hardlinks",
+                                    command=lambda: bulk_link(app, "hardlink"))
+    app.hardlink_button.pack(pady=2)
+    app.reflink_button = tk.Button(app.control_frame, text="Replace with Reflinks",
+                                   command=lambda: bulk_link(app, "reflink"))
+    app.reflink_button.pack(pady=2)
+
+    # Przerywanie skanowania działającego w tle
+    app.cancel_button = tk.Button(app.control_frame, text="Cancel", state=tk.DISABLED, command=lambda: cancel_scan(app))
+    app.cancel_button.pack(pady=5)
+
     # Dodajemy listę plików
-    app.file_listbox = tk.Listbox(app.control_frame, height=40, width=30, font=("TkDefaultFont", app.default_font.cget("size")))
+    app.file_listbox = VirtualListbox(app.control_frame, on_select=lambda index: select_file(app, index),
+                                      is_marked=lambda name: name in app.groups_with_deletions,
+                                      height=40, width=30, font=("TkDefaultFont", app.default_font.cget("size")))
     app.file_listbox.pack(fill=tk.Y, expand=True)
-    app.file_listbox.bind("<<ListboxSelect>>", lambda event: select_file(app, event))
         
 
 
@@ -416,18 +924,48 @@ class FileComparator:
         self.file_data = {}  # Używamy słownika zamiast listy
         self.current_index = 0
         self.compare_by_name = tk.BooleanVar(value=True)
+        self.ignore_copy_suffixes = tk.BooleanVar(value=False)
+        self.group_directories = tk.BooleanVar(value=False) # Całe zduplikowane katalogi jako jedna grupa
+        self.name_normalizer = name_rules.NameNormalizer() # "x (1).jpg", "Copy of x.jpg" -> "x.jpg"
         self.compare_by_size = tk.BooleanVar(value=False)
+        self.compare_by_content = tk.BooleanVar(value=False)
+        self.compare_by_video = tk.BooleanVar(value=False)
+        self.compare_by_similar = tk.BooleanVar(value=False)
+        self.compare_by_similar_video = tk.BooleanVar(value=False)
+        self.compare_by_similar_docs = tk.BooleanVar(value=False)
+        self.scan_workers = tk.IntVar(value=scanner.DEFAULT_WORKERS)
+        self.use_scan_index = tk.BooleanVar(value=True)
         self.deleted_files = set() # Zbiór usuniętych plików (ścieżki)
+        self.keep_rule = tk.StringVar(value=dedupe.KEEP_RULES[0]) # Który plik z grupy zostawia zbiorcze usuwanie
+        self.groups_with_deletions = set() # Nazwy grup, z których coś usunięto (na czerwono na liście)
+        self.group_names = [] # Kolejność grup na liście
+        self.file_index = None # Zeskanowane pliki z indeksami nazw i rozmiarów (grouping.FileIndex)
         self.current_directory = ""
+        self.scan_thread = None # Wątek skanujący działający w tle
+        self.regroup_pending = False # Kryteria zmieniono w trakcie zadania w tle - grupujemy po jego końcu
+        self.cache_stats = "" # Statystyki pamięci podręcznej skrótów z ostatniej operacji
+        self.video_info = thumbnails.VideoInfoCache() # Czas trwania, rozdzielczość i kodek filmów
+        self.thumbnail_cache = thumbnails.ThumbnailCache(video_info=self.video_info) # Miniatury podglądów (pamięć + dysk)
+        self.preview_pool = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS) # Dekodowanie miniatur w tle
+        self.preview_results = queue.Queue()
+        self.preview_futures = []
+        self.preview_generation = 0 # Numer wyświetlanej grupy, starsze wyniki są odrzucane
         
         for widget in self.root.winfo_children(): # Usuwamy wszystkie widgety z głównego okna
             widget.destroy()
         setup_controls_frame(self)
         setup_canvas_frame(self)
+
+        # Zmiana kryteriów przelicza grupy z indeksów, bez ponownego skanowania
+        for variable in (self.compare_by_name, self.compare_by_size, self.compare_by_content, self.compare_by_video,
+                         self.compare_by_similar, self.compare_by_similar_video, self.compare_by_similar_docs,
+                         self.ignore_copy_suffixes, self.group_directories):
+            variable.trace_add("write", lambda *args: regroup(self))
         
         # Bind the Escape key to close the application
         self.root.bind('<Escape>', lambda event: self.root.quit())
         self.root.bind('<Return>', lambda event: scan_directory(self))
+        self.root.after(PREVIEW_POLL_MS, lambda: poll_previews(self))
 
 
 if __name__ == "__main__":
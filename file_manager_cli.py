@@ -0,0 +1,200 @@
+import os
+import sys
+import csv
+import json
+import heapq
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from itertools import groupby
+import grouping
+import hashing
+import name_rules
+import scanner
+
+RUN_SIZE = 200_000  # ile rekordów sortujemy w pamięci przed zapisaniem serii na dysk
+
+
+def record_key(criteria, name, size):
+    # Ten sam klucz co w FileIndex.runs; przy samej nazwie pliki w grupie idą od największego
+    if criteria.get("name_key"):
+        name = criteria["name_key"](name)
+    if criteria["name"] and criteria["size"]:
+        return [size, name]
+    elif criteria["size"] or criteria["content"]:
+        return [size, name] if criteria["name"] else [size]
+    return [name, -size]
+
+
+def group_key(criteria, record):
+    return record[0] if criteria["size"] or criteria["content"] else record[0][:1]
+
+
+def write_run(records, directory):
+    records.sort()
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".jsonl", delete=False, encoding="utf-8",
+                                     errors="surrogateescape") as run:
+        for record in records:
+            run.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return run.name
+
+
+def read_run(path):
+    with open(path, encoding="utf-8", errors="surrogateescape") as run:
+        for line in run:
+            yield json.loads(line)
+
+
+def sorted_records(criteria, folder, workers, use_index, directory):
+    """Walk the tree and yield [key, size, path, dev, ino] records sorted by key.
+
+    At most RUN_SIZE records are held in memory; full runs are sorted and
+    spilled to `directory`, then merged (an external sort), so memory does
+    not grow with the size of the tree.
+    """
+    index = scanner.open_index() if use_index else None
+    runs = []
+    records = []
+    walker = scanner.walk(folder, workers, index)
+    try:
+        for path, files in walker:
+            prefix = os.path.join(path, "")
+            for name, size, _, dev, ino in files:
+                records.append([record_key(criteria, name, size), size, prefix + name, dev, ino])
+            if len(records) >= RUN_SIZE:
+                runs.append(write_run(records, directory))
+                records = []
+    finally:
+        walker.close()
+        if index is not None:
+            index.close()
+    records.sort()
+    if not runs:
+        yield from records
+        return
+    runs.append(write_run(records, directory))
+    del records
+    yield from heapq.merge(*(read_run(run) for run in runs))
+
+
+def collapse_links(run):
+    """Return (items, links) for a run of records: hardlinks of one file become a single item,
+    `links` maps its path to the other paths."""
+    files = {}
+    for _, size, path, dev, ino in run:
+        files.setdefault((dev, ino) if ino else path, []).append((size, path))
+    items = [paths[0] for paths in files.values()]
+    links = {paths[0][1]: [path for _, path in paths[1:]] for paths in files.values() if len(paths) > 1}
+    return items, links
+
+
+def find_groups(criteria, folder, workers=scanner.DEFAULT_WORKERS, use_index=False, cache=None):
+    """Yield (label, [(size, path), ...], links) for every duplicate group, as filter_files would label it.
+
+    Hardlinks count as one file; their other paths are in `links` ({path: [paths]}).
+    """
+    with tempfile.TemporaryDirectory(prefix="file_manager_") as directory:
+        records = sorted_records(criteria, folder, workers, use_index, directory)
+        for _, run in groupby(records, key=lambda record: group_key(criteria, record)):
+            items, links = collapse_links(run)
+            if len(items) < 2:
+                continue
+            name = os.path.basename(items[0][1])
+            if criteria.get("name_key"):
+                name = criteria["name_key"](name)
+            if criteria["content"]:
+                for digest, duplicates in hashing.split_by_content(items, cache):
+                    label = grouping.content_label(criteria, name, duplicates[0][0], len(duplicates), digest)
+                    yield label, duplicates, links
+            else:
+                yield grouping.group_label(criteria, name, items[0][0], len(items)), items, links
+
+
+class CsvWriter:
+    def __init__(self, output):
+        self.writer = csv.writer(output)
+        self.writer.writerow(["group", "label", "size", "path", "link_of"])
+
+    def write(self, group_id, label, items, links):
+        # Dowiązanie twarde dostaje osobny wiersz ze ścieżką pliku, do którego należy
+        for size, path in items:
+            self.writer.writerow([group_id, label, size, path, ""])
+            for link in links.get(path, ()):
+                self.writer.writerow([group_id, label, size, link, path])
+
+
+class JsonLinesWriter:
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, group_id, label, items, links):
+        files = []
+        for size, path in items:
+            entry = {"size": size, "path": path}
+            if path in links:
+                entry["links"] = links[path]
+            files.append(entry)
+        self.output.write(json.dumps({"group": group_id, "label": label, "files": files}, ensure_ascii=False) + "\n")
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonLinesWriter}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate files without the GUI and stream the groups out")
+    parser.add_argument("folder")
+    parser.add_argument("--name", action="store_true", help="compare by name")
+    parser.add_argument("--size", action="store_true", help="compare by size")
+    parser.add_argument("--content", action="store_true", help="compare by content (hash of same-size files)")
+    parser.add_argument("--ignore-copy-suffixes", nargs="?", const=",".join(name_rules.NAME_RULES), metavar="RULES",
+                        help="compare names without copy markers such as 'Copy of', ' (1)', '_v2'; "
+                             f"optionally only the given comma separated rules ({', '.join(name_rules.NAME_RULES)})")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("-o", "--output", help="output file (default: standard output)")
+    parser.add_argument("--workers", type=int, default=scanner.DEFAULT_WORKERS, help="scan threads")
+    parser.add_argument("--use-index", action="store_true", help="reuse the on-disk scan index")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"not a directory: {args.folder}")
+    # Tak jak w GUI: bez zaznaczonych kryteriów porównujemy po nazwie
+    criteria = {"name": args.name or not (args.size or args.content), "size": args.size,
+                "content": args.content, "video": False, "name_key": None}
+    if args.ignore_copy_suffixes is not None:
+        try:
+            criteria["name_key"] = name_rules.NameNormalizer(name_rules.parse_rules(args.ignore_copy_suffixes))
+        except ValueError as e:
+            parser.error(str(e))
+    cache = hashing.open_cache() if args.content else None
+
+    # Nazwy plików niebędące poprawnym UTF-8 zapisujemy bajt w bajt, tak jak są na dysku
+    if args.output:
+        output = open(args.output, "w", newline="", encoding="utf-8", errors="surrogateescape")
+    else:
+        output = sys.stdout
+        output.reconfigure(errors="surrogateescape")
+    groups = files = 0
+    try:
+        writer = WRITERS[args.format](output)
+        # Komunikaty o błędach skanera idą na stderr, żeby nie mieszały się z wynikami na stdout
+        with redirect_stdout(sys.stderr):
+            for label, items, links in find_groups(criteria, args.folder, max(1, args.workers), args.use_index, cache):
+                groups += 1
+                files += len(items)
+                writer.write(groups, label, items, links)
+                output.flush()
+    except KeyboardInterrupt:
+        print("Cancelled.", file=sys.stderr)
+        return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if cache is not None:
+            print(cache.stats_text(), file=sys.stderr)
+            cache.close()
+    print(f"{groups} groups, {files} files", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
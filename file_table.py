@@ -0,0 +1,140 @@
+import os
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # bez NumPy grupujemy zwykłym sortowaniem w Pythonie
+    np = None
+
+
+class FileTable:
+    """Columnar, memory-compact table of scanned files.
+
+    Every directory path and every file name is stored once (interned in
+    `dirs` / `names`); per file only five 8-byte columns (directory id, name
+    id, size, mtime_ns, inode number) and one byte of the `alive` mask are
+    kept. The device of a directory's files is kept once per directory.
+    Full path strings are built only for the rows that are actually shown.
+    """
+
+    def __init__(self):
+        self.dirs = []        # id katalogu -> ścieżka
+        self.dir_prefixes = []  # id katalogu -> ścieżka z separatorem na końcu (szybkie sklejanie ścieżek)
+        self.dir_ids = {}     # ścieżka -> id katalogu
+        self.dir_devs = []    # id katalogu -> st_dev jego plików
+        self.names = []       # id nazwy -> nazwa
+        self.name_ids = {}    # nazwa -> id nazwy
+        self.dir_col = array('q')
+        self.name_col = array('q')
+        self.size_col = array('q')
+        self.mtime_col = array('q')
+        self.ino_col = array('Q')  # st_ino, 0 gdy nieznany (np. Windows)
+        self.alive = bytearray()  # 0 dla plików usuniętych po skanowaniu
+
+    def __len__(self):
+        return len(self.size_col)
+
+    def __iter__(self):
+        # Zgodność ze starym formatem: krotki (nazwa, rozmiar, ścieżka)
+        for row in range(len(self)):
+            if self.alive[row]:
+                yield self.names[self.name_col[row]], self.size_col[row], self.path(row)
+
+    @classmethod
+    def from_tuples(cls, file_info):
+        table = cls()
+        for name, size, path in file_info:
+            table.append(os.path.dirname(path), name, size, 0)
+        return table
+
+    def intern_dir(self, dir_path, dev=0):
+        dir_id = self.dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self.dir_ids[dir_path] = len(self.dirs)
+            self.dirs.append(dir_path)
+            self.dir_prefixes.append(os.path.join(dir_path, ""))
+            self.dir_devs.append(dev)
+        return dir_id
+
+    def intern_name(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def append(self, dir_path, name, size, mtime_ns, dev=0, ino=0):
+        self.dir_col.append(self.intern_dir(dir_path, dev))
+        self.name_col.append(self.intern_name(name))
+        self.size_col.append(size)
+        self.mtime_col.append(mtime_ns)
+        self.ino_col.append(ino)
+        self.alive.append(1)
+
+    def add_dir(self, dir_path, files):
+        """Append the (name, size, mtime_ns, dev, ino) entries of one directory."""
+        # Pliki katalogu leżą na jego urządzeniu - st_dev zapisujemy raz na katalog
+        # (z pliku o znanym i-węźle; dowiązania symboliczne mają 0 i mogą wskazywać na inny dysk)
+        dir_id = self.intern_dir(dir_path, next((entry[3] for entry in files if entry[4]), 0))
+        for name, size, mtime_ns, _, ino in files:
+            self.dir_col.append(dir_id)
+            self.name_col.append(self.intern_name(name))
+            self.size_col.append(size)
+            self.mtime_col.append(mtime_ns)
+            self.ino_col.append(ino)
+            self.alive.append(1)
+
+    def path(self, row):
+        return self.dir_prefixes[self.dir_col[row]] + self.names[self.name_col[row]]
+
+    def name(self, row):
+        return self.names[self.name_col[row]]
+
+    def inode(self, row):
+        return self.dir_devs[self.dir_col[row]], self.ino_col[row]
+
+    def live_count(self):
+        return self.alive.count(1)
+
+    def find_rows(self, paths):
+        """Return the live rows of the given paths (one pass over the table)."""
+        targets = set()
+        for path in paths:
+            dir_id = self.dir_ids.get(os.path.dirname(path))
+            name_id = self.name_ids.get(os.path.basename(path))
+            if dir_id is not None and name_id is not None:
+                targets.add((dir_id, name_id))
+        if not targets:
+            return []
+        if np is not None:
+            # Klucz (katalog, nazwa) jako jedna liczba - porównanie całej kolumny naraz
+            width = len(self.names)
+            keys = self.column(self.dir_col) * width + self.column(self.name_col)
+            wanted = np.fromiter((d * width + n for d, n in targets), dtype=np.int64, count=len(targets))
+            rows = np.flatnonzero(np.isin(keys, wanted) & self.alive_mask())
+            return rows.tolist()
+        return [row for row in range(len(self))
+                if self.alive[row] and (self.dir_col[row], self.name_col[row]) in targets]
+
+    def kill(self, rows):
+        for row in rows:
+            self.alive[row] = 0
+
+    def column(self, col):
+        # Widok NumPy bez kopiowania; trzeba go porzucić przed kolejnym append
+        return np.frombuffer(col, dtype=np.uint64 if col.typecode == 'Q' else np.int64)
+
+    def alive_mask(self):
+        return np.frombuffer(self.alive, dtype=np.uint8).view(bool)
+
+    def memory_bytes(self):
+        """Approximate memory used by the table (columns, pools and their strings)."""
+        columns = (self.dir_col, self.name_col, self.size_col, self.mtime_col, self.ino_col)
+        total = sum(col.itemsize * len(col) for col in columns)
+        total += len(self.alive)
+        pools = ((self.dirs, self.dir_ids), (self.dir_prefixes, None), (self.dir_devs, None),
+                 (self.names, self.name_ids))
+        for pool, ids in pools:
+            total += sys.getsizeof(pool) + sys.getsizeof(ids) + sum(sys.getsizeof(s) for s in pool)
+        return total
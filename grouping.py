@@ -0,0 +1,507 @@
+import os
+import gc
+from contextlib import contextmanager
+from collections import defaultdict
+import hashing
+import scanner
+import similarity
+from file_table import FileTable, np
+
+
+@contextmanager
+def gc_paused():
+    # Przy budowaniu milionów małych list cykliczny GC zabiera więcej czasu niż samo grupowanie
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def run_starts(*keys):
+    # True tam, gdzie w posortowanych kluczach zaczyna się nowa seria
+    starts = np.ones(len(keys[0]), dtype=bool)
+    if len(keys[0]):
+        starts[1:] = keys[0][1:] != keys[0][:-1]
+        for key in keys[1:]:
+            starts[1:] |= key[1:] != key[:-1]
+    return starts
+
+
+def collision_mask(*keys):
+    """For sorted keys, mark the elements of runs longer than one."""
+    starts = run_starts(*keys)
+    run_ids = np.cumsum(starts) - 1
+    lengths = np.bincount(run_ids) if len(run_ids) else np.zeros(0, dtype=np.int64)
+    return lengths[run_ids] > 1
+
+
+def group_label(criteria, name, size, count):
+    """Display name of a name and/or size group (as shown in the group list)."""
+    if criteria["name"] and criteria["size"]:
+        return f"{name} ({size} bytes)"
+    elif criteria["size"]:
+        return f"Size: {size} bytes ({count} files)"
+    return name
+
+
+def content_label(criteria, name, size, count, digest):
+    if criteria["name"]:
+        return f"{name} ({size} bytes, {digest[:8]})"
+    return f"Content: {digest[:12]} ({size} bytes, {count} files)"
+
+
+def duplicate_directories(digests):
+    """Lists of directory ids (in scan order) sharing a digest; directories without files are skipped."""
+    by_digest = defaultdict(list)
+    for dir_id in sorted(digests):
+        digest, files, _ = digests[dir_id]
+        if files:
+            by_digest[digest].append(dir_id)
+    return [dir_ids for dir_ids in by_digest.values() if len(dir_ids) > 1]
+
+
+class FileIndex:
+    """Scanned files (a columnar FileTable) grouped by name and/or size.
+
+    Groups are found by sorting the name/size columns, so switching
+    comparison criteria or removing a deleted file regroups without touching
+    the filesystem (except for content and video modes, which read through
+    their caches). Hardlinks (rows with the same st_dev and st_ino) count as
+    one logical file: only its first live path in a group takes part, the
+    others are listed by link_paths(). Name modes group every path and
+    collapse links within each group, since links may have different names.
+    """
+
+    def __init__(self, file_info=()):
+        if isinstance(file_info, FileTable):
+            self.table = file_info
+        else:
+            self.table = FileTable.from_tuples(file_info)
+        self.orders = {}  # kolumna -> argsort wszystkich wierszy, liczony raz
+        self.links = None  # listy wierszy tego samego i-węzła (dowiązania twarde)
+        self.link_ids = {}  # wiersz -> numer jego listy w self.links
+        self.links_rows = 0
+        self.hidden = None  # wiersze dowiązań poza pierwszym żywym - pomijane przy grupowaniu
+        self.aliases = None
+        self.name_keys = None  # (funkcja klucza nazwy, kod klucza dla każdego id nazwy, klucz -> kod)
+
+    def __len__(self):
+        return self.table.live_count()
+
+    def __iter__(self):
+        table = self.table
+        hidden = set(self.hidden_rows())
+        for row in range(len(table)):
+            if table.alive[row] and row not in hidden:
+                yield table.name(row), table.size_col[row], table.path(row)
+
+    def add(self, name, size, path, mtime_ns=0, dev=0, ino=0):
+        self.table.append(os.path.dirname(path), name, size, mtime_ns, dev, ino)
+        self.hidden = self.aliases = None
+
+    def remove(self, path):
+        self.remove_many([path])
+
+    def remove_many(self, paths):
+        self.table.kill(self.table.find_rows(paths))
+        # Po usunięciu pierwszej ścieżki pliku jego miejsce zajmuje kolejne dowiązanie
+        self.hidden = self.aliases = None
+
+    def restat(self, paths):
+        """Re-read the inode and mtime of paths replaced on disk (e.g. by links), so new hardlinks are seen."""
+        table = self.table
+        for row in table.find_rows(paths):
+            try:
+                st = os.stat(table.path(row))
+            except OSError:
+                continue
+            table.ino_col[row] = st.st_ino
+            table.mtime_col[row] = st.st_mtime_ns
+        self.links = None
+        self.hidden = self.aliases = None
+
+    def link_sets(self):
+        """Lists of rows (live or not) that share st_dev and st_ino, i.e. hardlinks of one file."""
+        table = self.table
+        if self.links is not None and self.links_rows == len(table):
+            return self.links
+        if np is not None:
+            inodes = table.column(table.ino_col)
+            rows = np.argsort(inodes, kind="stable")
+            rows = rows[inodes[rows] != 0]
+            candidates = rows[collision_mask(inodes[rows])].tolist()
+        else:
+            by_ino = defaultdict(list)
+            for row, ino in enumerate(table.ino_col):
+                if ino:
+                    by_ino[ino].append(row)
+            candidates = [row for rows in by_ino.values() if len(rows) > 1 for row in rows]
+        # Ten sam numer i-węzła na różnych urządzeniach to różne pliki
+        by_inode = defaultdict(list)
+        for row in candidates:
+            by_inode[table.inode(row)].append(row)
+        self.links = [sorted(rows) for rows in by_inode.values() if len(rows) > 1]
+        self.link_ids = {row: n for n, rows in enumerate(self.links) for row in rows}
+        self.links_rows = len(table)
+        self.hidden = self.aliases = None
+        return self.links
+
+    def hidden_rows(self):
+        if self.hidden is None:
+            self.link_sets()
+            alive = self.table.alive
+            self.hidden = []
+            self.aliases = {}
+            for rows in self.links:
+                live = [row for row in rows if alive[row]]
+                if len(live) > 1:
+                    self.hidden.extend(live[1:])
+                    paths = [self.table.path(row) for row in live]
+                    for path in paths:
+                        self.aliases[path] = [other for other in paths if other != path]
+        return self.hidden
+
+    def link_paths(self, path):
+        """Other scanned paths of the same file (its hardlinks); empty for ordinary files."""
+        self.hidden_rows()
+        return self.aliases.get(path, [])
+
+    def visible_mask(self):
+        mask = self.table.alive_mask()
+        hidden = self.hidden_rows()
+        if hidden:
+            mask = mask.copy()
+            mask[hidden] = False
+        return mask
+
+    def items_for(self, rows):
+        size_col, dir_col, name_col = self.table.size_col, self.table.dir_col, self.table.name_col
+        prefixes, names = self.table.dir_prefixes, self.table.names
+        return [(size_col[row], prefixes[dir_col[row]] + names[name_col[row]]) for row in rows]
+
+    def sorted_rows(self, column, values=None, hide_links=True):
+        """Live rows ordered by a column, extra hardlinks left out unless `hide_links` is false.
+
+        The argsort is done once and reused after deletions. `values` are
+        the column's values when they are not a table column (normalized
+        name codes).
+        """
+        table = self.table
+        order = self.orders.get(column)
+        if order is None or len(order) != len(table):
+            if values is None:
+                values = table.column(getattr(table, column))
+            order = self.orders[column] = np.argsort(values, kind="stable")
+        mask = self.visible_mask() if hide_links else self.table.alive_mask()
+        return order[mask[order]]
+
+    def name_codes(self, name_key):
+        """Code of name_key(name) for every interned name id (an int64 array with NumPy, else a list).
+
+        name_key is called once per distinct name, not per file, and only
+        for names interned since the last call.
+        """
+        if self.name_keys is None or self.name_keys[0] is not name_key:
+            self.name_keys = (name_key, [], {})
+            self.orders.pop("name_key", None)
+        _, codes, key_ids = self.name_keys
+        for name in self.table.names[len(codes):]:
+            codes.append(key_ids.setdefault(name_key(name), len(key_ids)))
+        return np.array(codes, dtype=np.int64) if np is not None else codes
+
+    def run_bounds(self, by_name, by_size, name_key=None):
+        """Vectorized grouping; returns (rows, starts, ends) as NumPy arrays.
+
+        Sizes (or name codes) are argsorted once, run boundaries are found
+        where the sorted key changes and only runs longer than one are kept.
+        Name+size keys are resolved only among the size collisions, with
+        the interned name id as a factorized name code. Group i is
+        rows[starts[i]:ends[i]]; groups come in order of their first row,
+        i.e. in scan order. With `name_key` names compare by name_key(name).
+        """
+        table = self.table
+        sizes = table.column(table.size_col)
+        names = table.column(table.name_col)
+        if name_key is not None:
+            names = self.name_codes(name_key)[names]
+        if by_size:
+            # Dowiązania mają ten sam rozmiar, ale nie zawsze tę samą nazwę - przy nazwach zwijamy je później
+            rows = self.sorted_rows("size_col", hide_links=not by_name)
+            rows = rows[collision_mask(sizes[rows])]
+            if by_name:
+                # Numer serii rozmiaru i kod nazwy składamy w jeden klucz int64 - jedno sortowanie
+                # zamiast lexsort po dwóch kolumnach; stabilne, więc wiersze w obrębie klucza zostają rosnąco
+                size_codes = np.cumsum(run_starts(sizes[rows])) - 1
+                combined = size_codes * len(table.names) + names[rows]
+                order = np.argsort(combined, kind="stable")
+                rows, combined = rows[order], combined[order]
+                duplicated = collision_mask(combined)
+                rows, combined = rows[duplicated], combined[duplicated]
+            keys = (combined,) if by_name else (sizes[rows],)
+        else:
+            rows = (self.sorted_rows("name_col", hide_links=False) if name_key is None
+                    else self.sorted_rows("name_key", names, hide_links=False))
+            rows = rows[collision_mask(names[rows])]
+            keys = (names[rows],)
+
+        starts = np.flatnonzero(run_starts(*keys))
+        ends = np.append(starts[1:], len(rows))
+        # Pierwszy wiersz serii jest najwcześniejszy - po nim ustawiamy grupy
+        first_seen = np.argsort(rows[starts], kind="stable")
+        return rows, starts[first_seen], ends[first_seen]
+
+    def runs(self, by_name, by_size, name_key=None):
+        """Return lists of live rows sharing the same key; singletons are dropped."""
+        table = self.table
+        if np is None:
+            names = table.name_col if name_key is None else [self.name_codes(name_key)[i] for i in table.name_col]
+            file_dict = defaultdict(list)
+            hidden = set() if by_name else set(self.hidden_rows())
+            for row in range(len(table)):
+                if table.alive[row] and row not in hidden:
+                    key = (names[row] if by_name else None, table.size_col[row] if by_size else None)
+                    file_dict[key].append(row)
+            runs = [rows for rows in file_dict.values() if len(rows) > 1]
+            return self.collapse_links(runs) if by_name else runs
+
+        rows, starts, ends = self.run_bounds(by_name, by_size, name_key)
+        if by_name:
+            self.link_sets()
+        collapse = np.zeros(len(starts), dtype=bool)
+        if by_name and self.link_ids:
+            # Zwijamy tylko serie z co najmniej dwoma wierszami dowiązań - reszty nie przeglądamy w Pythonie
+            is_link = np.zeros(len(table), dtype=np.int64)
+            is_link[list(self.link_ids)] = 1
+            counts = np.concatenate(([0], np.cumsum(is_link[rows])))
+            collapse = counts[ends] - counts[starts] > 1
+        rows = rows.tolist()
+        with gc_paused():
+            runs = []
+            for start, end, linked in zip(starts.tolist(), ends.tolist(), collapse.tolist()):
+                if linked:
+                    runs.extend(self.collapse_links([rows[start:end]]))
+                else:
+                    runs.append(rows[start:end])
+            return runs
+
+    def collapse_links(self, runs):
+        # Z dowiązań twardych jednego pliku w grupie zostaje pierwszy wiersz; grupy z jednym plikiem odpadają
+        self.link_sets()
+        collapsed = []
+        for rows in runs:
+            seen = set()
+            kept = []
+            for row in rows:
+                link = self.link_ids.get(row)
+                if link is None or link not in seen:
+                    kept.append(row)
+                    seen.add(link)
+            if len(kept) > 1:
+                collapsed.append(kept)
+        return collapsed
+
+    def group(self, criteria, cancel=None, cache=None, pool=None):
+        """Return {display name: [(size, path), ...]} for the given criteria dict.
+
+        Content mode hashes through `pool` (a hash_pool.HashPool) when given.
+        criteria["name_key"], when set, maps a name to the key names are
+        compared by (e.g. a name_rules.NameNormalizer).
+        """
+        table = self.table
+        if criteria.get("directories"):
+            return self.group_with_directories(criteria, cancel, cache, pool)
+        elif criteria.get("similar") or criteria.get("similar_video") or criteria.get("similar_docs"):
+            return self.group_by_similarity(criteria, cancel)
+        elif criteria["video"]:
+            return self.group_by_video(criteria, cancel)
+        elif criteria["content"]:
+            return self.group_by_content(criteria, cancel, cache, pool)
+        name_key = criteria.get("name_key")
+        runs = self.runs(criteria["name"], criteria["size"], name_key)
+        with gc_paused():
+            filtered_files = {}
+            for rows in runs:
+                items = self.items_for(rows)
+                name = name_key(table.name(rows[0])) if name_key else table.name(rows[0])
+                filtered_files[group_label(criteria, name, table.size_col[rows[0]], len(rows))] = \
+                    sorted(items, key=lambda x: -x[0]) if not criteria["size"] else items
+            return filtered_files
+
+    def group_with_directories(self, criteria, cancel=None, cache=None, pool=None):
+        # Najpierw grupy całych katalogów, potem grupy plików spoza nich - zawartość zduplikowanych katalogów
+        # jest już reprezentowana przez ich grupę
+        filtered_files, covered = self.directory_groups(criteria, cancel, cache, pool)
+        dir_ids = self.table.dir_ids
+        for label, items in self.group(dict(criteria, directories=False), cancel, cache, pool).items():
+            if not all(dir_ids.get(os.path.dirname(path)) in covered for _, path in items):
+                filtered_files[label] = items
+        return filtered_files
+
+    def directory_digests(self, file_digests=None, cancel=None):
+        """Bottom-up Merkle digest of every scanned directory: {dir id: (digest, files, bytes)}.
+
+        A directory's digest covers the names and sizes of its live files
+        (and their content digests from `file_digests`, {path: digest}, when
+        given) and the names and digests of its subdirectories, so two
+        directories get the same digest exactly when their whole subtrees
+        match. It is computed from the scanned table, without touching the
+        disk; files and bytes are totals for the subtree.
+        """
+        table = self.table
+        entries = defaultdict(list)
+        names, dir_col, name_col, size_col = table.names, table.dir_col, table.name_col, table.size_col
+        alive = table.alive
+        for row in range(len(table)):
+            if not alive[row]:
+                continue
+            if cancel is not None and row % 100_000 == 0 and cancel.is_set():
+                raise scanner.ScanCancelled()
+            digest = file_digests.get(table.path(row), "") if file_digests is not None else ""
+            entries[dir_col[row]].append((names[name_col[row]], size_col[row], digest))
+
+        children = defaultdict(list)
+        for dir_id, path in enumerate(table.dirs):
+            parent = table.dir_ids.get(os.path.dirname(path))
+            if parent is not None and parent != dir_id:
+                children[parent].append(dir_id)
+
+        digests = {}
+        # Ścieżka podkatalogu jest zawsze dłuższa od ścieżki rodzica - dzieci liczymy przed rodzicami
+        for dir_id in sorted(range(len(table.dirs)), key=lambda dir_id: -len(table.dirs[dir_id])):
+            files = sorted(entries.get(dir_id, ()))
+            subdirs = sorted((os.path.basename(table.dirs[child]), digests[child])
+                             for child in children.get(dir_id, ()))
+            hasher = hashing.new_hasher()
+            for name, size, digest in files:
+                hasher.update(f"f\0{name}\0{size}\0{digest}\n".encode("utf-8", "surrogateescape"))
+            for name, (digest, _, _) in subdirs:
+                hasher.update(f"d\0{name}\0{digest}\n".encode("utf-8", "surrogateescape"))
+            digests[dir_id] = (hasher.hexdigest(),
+                               len(files) + sum(count for _, (_, count, _) in subdirs),
+                               sum(size for _, size, _ in files) + sum(size for _, (_, _, size) in subdirs))
+        return digests
+
+    def directory_groups(self, criteria, cancel=None, cache=None, pool=None):
+        """Return ({display name: [(bytes, directory), ...]}, ids of all duplicated directories).
+
+        Directories with identical subtrees (by names and sizes, and by
+        content in content mode) form a group. A group whose directories all
+        sit inside other duplicated directories is left out, so only the
+        topmost copies are listed.
+        """
+        table = self.table
+        digests = self.directory_digests(cancel=cancel)
+        groups = duplicate_directories(digests)
+        if criteria["content"] and groups:
+            # Skróty zawartości tylko dla plików kandydatów; ich podkatalogi też są kandydatami
+            candidates = {dir_id for dir_ids in groups for dir_id in dir_ids}
+            items = [(table.size_col[row], table.path(row)) for row in range(len(table))
+                     if table.alive[row] and table.dir_col[row] in candidates]
+            if pool is not None:
+                file_digests = pool.digests(items, "full")
+            else:
+                file_digests = {}
+                for size, path in items:
+                    if cancel is not None and cancel.is_set():
+                        raise scanner.ScanCancelled()
+                    try:
+                        file_digests[path] = cache.digest(path, "full") if cache else hashing.full_hash(path)
+                    except OSError:
+                        print(f'Błąd odczytu pliku: {path}')
+            digests = self.directory_digests(file_digests, cancel)
+            groups = duplicate_directories({dir_id: digests[dir_id] for dir_id in candidates})
+
+        covered = {dir_id for dir_ids in groups for dir_id in dir_ids}
+        filtered_files = {}
+        for dir_ids in groups:
+            if all(table.dir_ids.get(os.path.dirname(table.dirs[dir_id])) in covered for dir_id in dir_ids):
+                continue
+            _, files, size = digests[dir_ids[0]]
+            name = os.path.basename(table.dirs[dir_ids[0]]) or table.dirs[dir_ids[0]]
+            label = f"Folder: {name} ({len(dir_ids)} copies, {files:,} files, {size:,} bytes)"
+            if label in filtered_files:
+                label += f" [{len(filtered_files) + 1}]"
+            filtered_files[label] = [(size, table.dirs[dir_id]) for dir_id in dir_ids]
+        return filtered_files, covered
+
+    def group_by_content(self, criteria, cancel=None, cache=None, pool=None):
+        # Kandydaci to pliki o tym samym rozmiarze (i nazwie, jeśli zaznaczono)
+        filtered_files = {}
+        name_key = criteria.get("name_key")
+        runs = self.runs(criteria["name"], True, name_key)
+        if pool is not None:
+            # Pula dostaje wszystkie grupy naraz i sama układa odczyty według urządzeń
+            parts = pool.split_groups([self.items_for(rows) for rows in runs])
+        for i, rows in enumerate(runs):
+            if cancel is not None and cancel.is_set():
+                raise scanner.ScanCancelled()
+            split = parts[i] if pool is not None else hashing.split_by_content(self.items_for(rows), cache)
+            for digest, duplicates in split:
+                name = name_key(self.table.name(rows[0])) if name_key else self.table.name(rows[0])
+                label = content_label(criteria, name, duplicates[0][0], len(duplicates), digest)
+                filtered_files[label] = duplicates
+        return filtered_files
+
+    def group_by_video(self, criteria, cancel=None):
+        # criteria["video_key"](path) zwraca (czas, szerokość, wysokość, kodek) albo None dla innych plików
+        file_dict = defaultdict(list)
+        for name, size, path in self:
+            if cancel is not None and cancel.is_set():
+                raise scanner.ScanCancelled()
+            try:
+                key = criteria["video_key"](path)
+            except (OSError, ValueError) as e:
+                print(f'Błąd odczytu filmu: {path} - {e}')
+                continue
+            if key is None:
+                continue
+            if criteria["name"]:
+                key += (criteria["name_key"](name) if criteria.get("name_key") else name,)
+            if criteria["size"]:
+                key += (size,)
+            file_dict[key].append((size, path))
+
+        filtered_files = {}
+        for key, items in file_dict.items():
+            if len(items) > 1:
+                duration, width, height, codec = key[:4]
+                count = f"{len(items)} files, {key[-1]} bytes" if criteria["size"] else f"{len(items)} files"
+                display_name = f"Video: {width}x{height}, {duration} s, {codec or '?'} ({count})"
+                if criteria["name"]:
+                    display_name = f"{key[4]} - {display_name}"
+                # Etykieta musi być unikalna - inaczej grupa nadpisałaby wcześniejszą
+                if display_name in filtered_files:
+                    display_name += f" [{len(filtered_files) + 1}]"
+                filtered_files[display_name] = sorted(items, key=lambda x: -x[0])
+        return filtered_files
+
+    def group_by_similarity(self, criteria, cancel=None):
+        # criteria["image_hashes"](items, cancel) zwraca {ścieżka: dHash} dla obrazów spośród items,
+        # criteria["video_fingerprints"](items, cancel) - {ścieżka: [dHash klatki, ...]} dla filmów,
+        # criteria["document_signatures"](items, cancel) - {ścieżka: sygnatura MinHash} dla plików tekstowych
+        items = [(size, path) for _, size, path in self]
+        sizes = dict((path, size) for size, path in items)
+        clusters = []
+        if criteria.get("similar"):
+            hashes = criteria["image_hashes"](items, cancel)
+            clusters += [("Similar images", paths) for paths in similarity.cluster_hashes(hashes, cancel=cancel)]
+        if criteria.get("similar_video"):
+            fingerprints = criteria["video_fingerprints"](items, cancel)
+            clusters += [("Similar videos", paths)
+                         for paths in similarity.cluster_sequences(fingerprints, cancel=cancel)]
+        if criteria.get("similar_docs"):
+            signatures = criteria["document_signatures"](items, cancel)
+            clusters += [("Similar documents", paths)
+                         for paths in similarity.cluster_signatures(signatures, cancel=cancel)]
+        filtered_files = {}
+        for kind, paths in clusters:
+            # Największy plik (zwykle oryginał w pełnej rozdzielczości) na początku
+            group = sorted(((sizes[path], path) for path in paths), key=lambda x: -x[0])
+            label = f"{kind}: {os.path.basename(group[0][1])} ({len(group)} files)"
+            if label in filtered_files:
+                label += f" [{len(filtered_files) + 1}]"
+            filtered_files[label] = group
+        return filtered_files
@@ -0,0 +1,365 @@
+import os
+import time
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import hashing
+import scanner
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+ROTATIONAL_READS = 1     # dysk talerzowy: równoległe odczyty to głównie ruch głowicy
+SOLID_STATE_READS = 4    # SSD/NVMe dobrze znosi kilka odczytów naraz
+UNKNOWN_READS = 2        # NFS, urządzenia bez wpisu w /sys
+INLINE_JOBS = 16         # mniej plików liczymy w bieżącym wątku - start puli procesów kosztuje więcej
+
+
+def hash_file(path, size, kind, use_mmap=False):
+    """Return (digest, bytes read); runs in a worker process.
+
+    For kind "lockstep" path is a list of (size, path) items and the result
+    is that of hashing.compare_lockstep. use_mmap is passed to
+    hashing.full_hash and is only safe in a worker process.
+    """
+    if kind == "lockstep":
+        return hashing.compare_lockstep(path)
+    elif kind == "full":
+        return hashing.full_hash(path, use_mmap), size
+    return hashing.partial_hash(path, size), min(size, 2 * hashing.PARTIAL_BLOCK)
+
+
+def device_name(dev):
+    if hasattr(os, "major"):
+        return f"{os.major(dev)}:{os.minor(dev)}"
+    return str(dev)
+
+
+def device_read_limit(dev):
+    """How many files of one device are hashed at once, from the kernel's rotational flag."""
+    if not hasattr(os, "major"):
+        return UNKNOWN_READS
+    base = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    # Partycja nie ma własnego katalogu queue - flaga jest przy całym dysku
+    for path in (f"{base}/queue/rotational", f"{base}/../queue/rotational"):
+        try:
+            with open(path) as f:
+                return ROTATIONAL_READS if f.read().strip() == "1" else SOLID_STATE_READS
+        except OSError:
+            continue
+    return UNKNOWN_READS
+
+
+class DeviceStats:
+    """Bytes hashed from one device and the time it had reads in flight."""
+
+    def __init__(self, dev):
+        self.name = device_name(dev)
+        self.limit = device_read_limit(dev)
+        self.running = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.busy_since = 0.0
+
+    def started(self):
+        if self.running == 0:
+            self.busy_since = time.monotonic()
+        self.running += 1
+
+    def finished(self, bytes_read):
+        self.running -= 1
+        self.bytes += bytes_read
+        if self.running == 0:
+            self.busy += time.monotonic() - self.busy_since
+
+    def rate(self):
+        busy = self.busy + (time.monotonic() - self.busy_since if self.running else 0.0)
+        return self.bytes / busy / (1024 * 1024) if busy > 0 else 0.0
+
+
+class HashPool:
+    """Content hashing spread over a process pool, scheduled per device.
+
+    Files are read in (st_dev, st_ino) order - on spinning disks inode order
+    roughly follows the on-disk layout - and at most the device's read limit
+    of them are hashed at once, so a rotational disk is not made to seek
+    between parallel reads and one slow device cannot take every worker.
+    HashCache lookups and updates stay in the calling thread.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, cache=None, cancel=None, progress=None):
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.cancel = cancel
+        self.progress = progress  # progress(tekst) co najwyżej co PROGRESS_INTERVAL sekund
+        self.devices = {}
+        self.pool = None
+        self.files_done = 0
+        self.files_total = 0
+        self.last_report = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            # Przy anulowaniu nie czekamy na pliki, które jeszcze nie wystartowały
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def device(self, dev):
+        stats = self.devices.get(dev)
+        if stats is None:
+            stats = self.devices[dev] = DeviceStats(dev)
+        return stats
+
+    def check_cancel(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise scanner.ScanCancelled()
+
+    def rates_text(self):
+        return ", ".join(f"{stats.name} {stats.rate():,.1f} MB/s" for stats in self.devices.values() if stats.bytes)
+
+    def stats_text(self):
+        total = sum(stats.bytes for stats in self.devices.values())
+        if not total:
+            return ""
+        return f"Hashed {total / (1024 * 1024):,.1f} MB ({self.rates_text()})"
+
+    def report(self):
+        if self.progress is not None and time.monotonic() - self.last_report >= scanner.PROGRESS_INTERVAL:
+            self.last_report = time.monotonic()
+            rates = self.rates_text()
+            self.progress(f"Hashing files: {self.files_done:,} of {self.files_total:,}" + (f" ({rates})" if rates else ""))
+
+    def run(self, jobs, kind):
+        """Hash (dev, ino, size, path, key) jobs; yields (path, key, result) in completion order."""
+        jobs.sort()
+        self.files_total += len(jobs)
+        if len(jobs) < INLINE_JOBS or self.workers < 2:
+            yield from self.run_inline(jobs, kind)
+            return
+
+        if self.pool is None:
+            # spawn - wątki Tk i SQLite w procesie nadrzędnym nie są bezpieczne dla fork
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        queues = defaultdict(deque)
+        for job in jobs:
+            queues[job[0]].append(job)
+        running = {}
+        left = []
+        try:
+            while queues or running:
+                self.check_cancel()
+                for dev in list(queues):
+                    stats, pending = self.device(dev), queues[dev]
+                    while pending and stats.running < stats.limit and len(running) < self.workers:
+                        # Pliki mapujemy tylko w procesach puli - SIGBUS przy skróconym pliku zabija wtedy tylko proces
+                        future = self.pool.submit(hash_file, pending[0][3], pending[0][2], kind, True)
+                        running[future] = pending.popleft()
+                        stats.started()
+                    if not pending:
+                        del queues[dev]
+                done, _ = wait(running, timeout=scanner.PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    dev, ino, size, path, key = job
+                    try:
+                        value, bytes_read = future.result()
+                    except BrokenExecutor:
+                        running[future] = job  # policzymy go jeszcze raz, już bez puli
+                        raise
+                    except OSError:
+                        self.device(dev).finished(0)
+                        print(f'Błąd odczytu pliku: {path}')
+                        continue
+                    self.device(dev).finished(bytes_read)
+                    self.files_done += 1
+                    yield path, key, value
+                self.report()
+        except BrokenExecutor:
+            # Proces puli zginął (np. plik skrócono w trakcie mapowania) - resztę liczymy tutaj, bez mmap
+            print('Błąd puli procesów - pozostałe pliki liczone bez niej')
+            for dev, *_ in running.values():
+                self.device(dev).finished(0)
+            left = sorted(list(running.values()) + [job for pending in queues.values() for job in pending])
+            running.clear()
+            self.close()
+        finally:
+            for future in running:
+                future.cancel()
+        yield from self.run_inline(left, kind)
+
+    def run_inline(self, jobs, kind):
+        # Bez puli procesów - w bieżącym wątku, pełne skróty czytane do bufora (bez mmap)
+        for dev, ino, size, path, key in jobs:
+            self.check_cancel()
+            stats = self.device(dev)
+            stats.started()
+            try:
+                value, bytes_read = hash_file(path, size, kind)
+            except OSError:
+                stats.finished(0)
+                print(f'Błąd odczytu pliku: {path}')
+                continue
+            stats.finished(bytes_read)
+            self.files_done += 1
+            self.report()
+            yield path, key, value
+
+    def digests(self, items, kind):
+        """Return {path: 'partial' or 'full' digest} for (size, path) items, reading only cache misses."""
+        found = {}
+        jobs = []
+        links = defaultdict(list)  # dowiązania twarde czytamy raz: ścieżka z zadania -> pozostałe ścieżki
+        first_path = {}
+        for size, path in items:
+            try:
+                st = os.stat(path)
+            except OSError:
+                print(f'Błąd odczytu pliku: {path}')
+                continue
+            inode = (st.st_dev, st.st_ino)
+            if st.st_ino and inode in first_path:
+                links[first_path[inode]].append(path)
+                continue
+            first_path[inode] = path
+            key = None
+            if self.cache is not None:
+                key, value = self.cache.lookup(path, kind, st)
+                if value is not None:
+                    found[path] = value
+                    continue
+            jobs.append((st.st_dev, st.st_ino, st.st_size, path, key))
+        for path, key, value in self.run(jobs, kind):
+            found[path] = value
+            if key is not None:
+                self.cache.store(key, path, kind, value)
+        for path, others in links.items():
+            if path in found:
+                found.update(dict.fromkeys(others, found[path]))
+        return found
+
+    def split_groups(self, groups):
+        """hashing.split_by_content for many lists of (size, path) at once.
+
+        All partial hashes of all groups are scheduled together, then all
+        full hashes of the survivors, so the pool and the per-device queues
+        see the whole workload. Sizes shared by only a few files are compared
+        in lockstep by a single job instead. Returns a list of (digest, items)
+        lists, one per input group.
+        """
+        slots = [[] for _ in groups]  # dla każdej grupy: lista list (digest, pliki) w kolejności rozmiarów
+        candidates = []
+        lockstep = []
+        for group_no, items in enumerate(groups):
+            by_size = defaultdict(list)
+            for size, path in items:
+                by_size[size].append((size, path))
+            for size, same_size in by_size.items():
+                if len(same_size) < 2:
+                    continue
+                slot = []
+                slots[group_no].append(slot)
+                if size == 0:
+                    # Puste pliki są zawsze identyczne
+                    slot.append((hashing.new_hasher().hexdigest(), same_size))
+                elif size > 2 * hashing.PARTIAL_BLOCK and len(same_size) <= hashing.LOCKSTEP_MAX_FILES:
+                    lockstep.append((slot, same_size))
+                else:
+                    candidates.append((slot, size, same_size))
+
+        self.split_lockstep(lockstep)
+        partial = self.digests((item for _, _, same_size in candidates for item in same_size), "partial")
+        survivors = []
+        for slot, size, same_size in candidates:
+            for digest, bucket in bucket_by(same_size, partial).items():
+                if len(bucket) < 2:
+                    continue
+                if size <= 2 * hashing.PARTIAL_BLOCK:
+                    # Skrót częściowy objął cały plik
+                    slot.append((digest, bucket))
+                else:
+                    survivors.append((slot, bucket))
+
+        full = self.digests((item for _, bucket in survivors for item in bucket), "full")
+        for slot, bucket in survivors:
+            for digest, duplicates in bucket_by(bucket, full).items():
+                if len(duplicates) > 1:
+                    slot.append((digest, duplicates))
+        return [[part for slot in group_slots for part in slot] for group_slots in slots]
+
+    def split_lockstep(self, buckets):
+        # Każda mała grupa to jedno zadanie: pliki czytane naraz, blok po bloku
+        jobs = []
+        for slot, items in buckets:
+            keys = {}
+            if self.cache is not None:
+                keys, groups = hashing.cached_split(items, self.cache)
+                if groups is not None:
+                    slot.extend(groups)
+                    continue
+            try:
+                st = os.stat(items[0][1])
+            except OSError:
+                st = None
+            jobs.append((st.st_dev if st else 0, st.st_ino if st else 0, items[0][0], items, (slot, keys)))
+        for items, (slot, keys), groups in self.run(jobs, "lockstep"):
+            slot.extend(groups)
+            if self.cache is not None:
+                hashing.store_groups(self.cache, keys, groups)
+
+
+def cached_hashes(paths, kind, worker, cache=None, cancel=None, workers=DEFAULT_WORKERS, chunksize=1):
+    """Return {path: text} for paths, from `cache` (a hashing.HashCache) column `kind` or from `worker`.
+
+    `worker(path)` returns (path, text or None) and runs in a process pool,
+    `chunksize` paths per task, for files that are new or changed since
+    they were last hashed. `worker` must be importable by the spawned
+    processes (a module level function).
+    """
+    found = {}
+    keys = {}
+    missing = []
+    for path in paths:
+        if cache is not None:
+            try:
+                keys[path], value = cache.lookup(path, kind)
+            except OSError:
+                print(f'Błąd odczytu pliku: {path}')
+                continue
+            if value is not None:
+                found[path] = value
+                continue
+        missing.append(path)
+
+    def collect(results):
+        for path, value in results:
+            if cancel is not None and cancel.is_set():
+                raise scanner.ScanCancelled()
+            if value is None:
+                print(f'Błąd odczytu pliku: {path}')
+                continue
+            found[path] = value
+            if path in keys:
+                cache.store(keys[path], path, kind, value)
+
+    if len(missing) < INLINE_JOBS or workers < 2:
+        collect(map(worker, missing))
+        return found
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        collect(pool.map(worker, missing, chunksize=chunksize))
+    finally:
+        # Przy anulowaniu nie czekamy na pliki, które jeszcze nie wystartowały
+        pool.shutdown(wait=False, cancel_futures=True)
+    return found
+
+
+def bucket_by(items, digests):
+    buckets = defaultdict(list)
+    for size, path in items:
+        if path in digests:
+            buckets[digests[path]].append((size, path))
+    return buckets
@@ -0,0 +1,316 @@
+import os
+import mmap
+import time
+import hashlib
+import sqlite3
+from collections import defaultdict
+import storage
+
+PARTIAL_BLOCK = 4096         # ile bajtów z początku i końca pliku bierzemy do skrótu częściowego
+CHUNK_SIZE = 1024 * 1024     # rozmiar bloku przy pełnym czytaniu pliku
+MMAP_MIN_SIZE = 8 * CHUNK_SIZE  # od tej wielkości pełny skrót liczymy z pliku zmapowanego w pamięci
+LOCKSTEP_MAX_FILES = 3       # tak małe grupy porównujemy blok po bloku zamiast liczyć skróty każdego pliku
+CACHE_MAX_ENTRIES = 2_000_000     # powyżej tej liczby wpisów usuwamy najdawniej używane
+CACHE_COMPACT_INTERVAL = 24 * 3600  # jak często (s) sprawdzamy, czy pliki z pamięci podręcznej istnieją
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=20)
+
+
+def partial_hash(path, size):
+    """Hash the first and last PARTIAL_BLOCK bytes of a file."""
+    hasher = new_hasher()
+    with open(path, "rb") as f:
+        hasher.update(f.read(PARTIAL_BLOCK))
+        if size > 2 * PARTIAL_BLOCK:
+            f.seek(size - PARTIAL_BLOCK)
+            hasher.update(f.read(PARTIAL_BLOCK))
+        elif size > PARTIAL_BLOCK:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def full_hash(path, use_mmap=False):
+    """Hash the whole file, read into a single reused buffer.
+
+    With use_mmap, files of at least MMAP_MIN_SIZE bytes are mapped with
+    mmap and hashed straight from the page cache (with MADV_SEQUENTIAL for
+    aggressive read-ahead), without copying them into bytes objects. A file
+    truncated while mapped kills the process with SIGBUS, so only pool
+    worker processes (see hash_pool.HashPool) should ask for it.
+    """
+    hasher = new_hasher()
+    with open(path, "rb", buffering=0) as f:
+        if use_mmap and os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE and hash_mapped(f, hasher):
+            return hasher.hexdigest()
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+    return hasher.hexdigest()
+
+
+def hash_mapped(f, hasher):
+    # Zwraca False, gdy pliku nie da się zmapować (np. niektóre systemy sieciowe, 32-bitowa przestrzeń adresowa)
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, OverflowError):
+        return False
+    with mapped:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        # Skrót czyta bezpośrednio z mapowania (bufor), bez GIL-a
+        hasher.update(mapped)
+    return True
+
+
+class HashCache:
+    """Persistent digest store keyed by stat identity (st_dev, st_ino, st_size, st_mtime_ns).
+
+    The key is checked with a single os.stat() before any bytes are read,
+    so unchanged files are never hashed twice. Besides the 'partial' and
+    'full' content digests it keeps the 'dhash' perceptual hash of images,
+    the 'frames' fingerprint (frame hashes) of videos and the 'minhash'
+    signature of text files. The path (as os.fsencode() bytes, so any file
+    name fits) is kept only to find entries whose files are gone during
+    compaction. A connection must be used from the thread that opened it.
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS digests ("
+        "dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+        "path BLOB NOT NULL, partial TEXT, full TEXT, dhash TEXT, frames TEXT, minhash TEXT, "
+        "last_used INTEGER NOT NULL, "
+        "PRIMARY KEY (dev, ino, size, mtime_ns))",
+        "CREATE INDEX IF NOT EXISTS digests_last_used ON digests (last_used)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    ]
+
+    def __init__(self, name="hash_cache"):
+        self.connection = storage.open_database(name, self.SCHEMA, version=7)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.now = int(time.time())
+
+    def lookup(self, path, kind, st=None):
+        """Return (key, value) of a digest column ('partial', 'full', 'dhash', ...) for path; value is None on a miss.
+
+        `st` is an os.stat() result the caller already has.
+        """
+        if st is None:
+            st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        row = self.connection.execute(
+            f"SELECT {kind} FROM digests WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+        if row is None or row[0] is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        self.bytes_saved += min(st.st_size, 2 * PARTIAL_BLOCK) if kind == "partial" else st.st_size
+        self.connection.execute(
+            "UPDATE digests SET last_used = ?, path = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+            (self.now, os.fsencode(path)) + key)
+        return key, row[0]
+
+    def store(self, key, path, kind, value):
+        self.connection.execute(
+            f"INSERT INTO digests (dev, ino, size, mtime_ns, path, {kind}, last_used) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            f"ON CONFLICT (dev, ino, size, mtime_ns) DO UPDATE SET {kind} = excluded.{kind}, "
+            "path = excluded.path, last_used = excluded.last_used",
+            key + (os.fsencode(path), value, self.now))
+
+    def digest(self, path, kind):
+        """Return the 'partial' or 'full' digest of path, computing it only on a cache miss."""
+        key, value = self.lookup(path, kind)
+        if value is None:
+            value = full_hash(path) if kind == "full" else partial_hash(path, key[2])
+            self.store(key, path, kind, value)
+        return value
+
+    def compact(self, force=False):
+        """Drop entries whose files are gone or changed, then trim to CACHE_MAX_ENTRIES by last use."""
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'last_compact'").fetchone()
+        if not force and row is not None and self.now - row[0] < CACHE_COMPACT_INTERVAL:
+            return 0
+        stale = []
+        for dev, ino, size, mtime_ns, path in self.connection.execute(
+                "SELECT dev, ino, size, mtime_ns, path FROM digests WHERE last_used < ?", (self.now,)):
+            try:
+                st = os.stat(os.fsdecode(path))
+                if (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns) == (dev, ino, size, mtime_ns):
+                    continue
+            except OSError:
+                pass
+            stale.append((dev, ino, size, mtime_ns))
+        self.connection.executemany(
+            "DELETE FROM digests WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?", stale)
+        self.connection.execute(
+            "DELETE FROM digests WHERE rowid IN (SELECT rowid FROM digests ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (CACHE_MAX_ENTRIES,))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_compact', ?)", (self.now,))
+        self.connection.commit()
+        return len(stale)
+
+    def stats_text(self):
+        return (f"Hash cache: {self.hits:,} hits, {self.misses:,} misses, "
+                f"{self.bytes_saved / (1024 * 1024):,.1f} MB not read")
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def open_cache():
+    try:
+        return HashCache()
+    except sqlite3.Error as e:
+        print(f'Błąd otwierania pamięci podręcznej skrótów: {e}')
+        return None
+
+
+def _bucket(items, hash_func):
+    buckets = defaultdict(list)
+    for size, path in items:
+        try:
+            buckets[hash_func(path, size)].append((size, path))
+        except OSError:
+            print(f'Błąd odczytu pliku: {path}')
+    return buckets
+
+
+def compare_lockstep(items):
+    """Split same-size (size, path) items into groups of identical files by reading them side by side.
+
+    The files are read block by block in lockstep (PARTIAL_BLOCK bytes first,
+    then CHUNK_SIZE) and a group is split as soon as its blocks differ. A file
+    left without a partner is closed at once, so a non-duplicate costs a
+    single block read. Each surviving group is hashed once while it is read,
+    so its digest equals full_hash of every member.
+    Returns ([(digest, items)], bytes read).
+    """
+    files = []
+    found = []
+    bytes_read = 0
+    try:
+        for size, path in items:
+            try:
+                files.append(((size, path), open(path, "rb")))
+            except OSError:
+                print(f'Błąd odczytu pliku: {path}')
+        groups = [(new_hasher(), files)] if len(files) > 1 else []
+        block = PARTIAL_BLOCK
+        while groups:
+            next_groups = []
+            for hasher, members in groups:
+                by_block = defaultdict(list)
+                for item, f in members:
+                    try:
+                        chunk = f.read(block)
+                    except OSError:
+                        print(f'Błąd odczytu pliku: {item[1]}')
+                        f.close()
+                        continue
+                    bytes_read += len(chunk)
+                    by_block[chunk].append((item, f))
+                for chunk, same in by_block.items():
+                    if len(same) < 2:
+                        # Plik bez pary - dalej go nie czytamy
+                        same[0][1].close()
+                        continue
+                    if not chunk:
+                        found.append((hasher.hexdigest(), [item for item, _ in same]))
+                        continue
+                    branch = hasher.copy() if len(by_block) > 1 else hasher
+                    branch.update(chunk)
+                    next_groups.append((branch, same))
+            groups = next_groups
+            block = CHUNK_SIZE
+    finally:
+        for _, f in files:
+            f.close()
+    return found, bytes_read
+
+
+def cached_split(items, cache, kind="full"):
+    """Return (keys, groups): the HashCache keys of items by path, and their
+    groups if every item's digest is already cached (otherwise None)."""
+    keys = {}
+    digests = {}
+    for size, path in items:
+        try:
+            keys[path], digests[path] = cache.lookup(path, kind)
+        except OSError:
+            print(f'Błąd odczytu pliku: {path}')
+    if len(digests) < len(items) or None in digests.values():
+        return keys, None
+    buckets = _bucket(items, lambda path, size: digests[path])
+    return keys, [(digest, duplicates) for digest, duplicates in buckets.items() if len(duplicates) > 1]
+
+
+def store_groups(cache, keys, groups, kind="full"):
+    for digest, duplicates in groups:
+        for _, path in duplicates:
+            if path in keys:
+                cache.store(keys[path], path, kind, digest)
+
+
+def split_lockstep(items, cache=None):
+    """compare_lockstep, skipped when a HashCache already has the full digest of every file."""
+    keys = {}
+    if cache is not None:
+        keys, groups = cached_split(items, cache)
+        if groups is not None:
+            return groups
+    groups, _ = compare_lockstep(items)
+    if cache is not None:
+        store_groups(cache, keys, groups)
+    return groups
+
+
+def split_by_content(items, cache=None):
+    """Split a list of (size, path) into groups of identical files.
+
+    Returns a list of (digest, items) for every group with more than one file.
+    Only files whose size collides are read; the full hash is computed only
+    for files that survive the partial (first/last block) hash. Sizes shared
+    by at most LOCKSTEP_MAX_FILES files are compared in lockstep instead.
+    With a HashCache, digests of unchanged files are taken from it.
+    """
+    if cache is None:
+        partial, full = partial_hash, lambda path, size: full_hash(path)
+    else:
+        partial = lambda path, size: cache.digest(path, "partial")
+        full = lambda path, size: cache.digest(path, "full")
+
+    by_size = defaultdict(list)
+    for size, path in items:
+        by_size[size].append((size, path))
+
+    groups = []
+    for size, same_size in by_size.items():
+        if len(same_size) < 2:
+            continue
+        if size == 0:
+            # Puste pliki są zawsze identyczne
+            groups.append((new_hasher().hexdigest(), same_size))
+            continue
+        if size > 2 * PARTIAL_BLOCK and len(same_size) <= LOCKSTEP_MAX_FILES:
+            groups.extend(split_lockstep(same_size, cache))
+            continue
+        for digest, candidates in _bucket(same_size, partial).items():
+            if len(candidates) < 2:
+                continue
+            if size <= 2 * PARTIAL_BLOCK:
+                # Skrót częściowy objął cały plik
+                groups.append((digest, candidates))
+                continue
+            for digest, duplicates in _bucket(candidates, full).items():
+                if len(duplicates) > 1:
+                    groups.append((digest, duplicates))
+    return groups
@@ -0,0 +1,49 @@
+import re
+
+# Reguły rozpoznające kopie tego samego pliku; klucz to nazwa reguły, wartość - (miejsce, wzorzec)
+NAME_RULES = {
+    "copy_prefix": ("prefix", r"(?:copy(?:\s*\(\d+\))? of|kopia)\s+"),        # "Copy of x", "Copy (2) of x", "Kopia x"
+    # "x — kopia (7)", "x - Copy", "x copy 2", "x (copy)"; bez separatora ("photocopy", "my_copy") to nie kopia
+    "copy_suffix": ("suffix", r"(?:(?:\s*[-—–]\s*|\s+)(?:kopia|copy)\b(?:\s*\(\d+\)|\s+\d+)?"
+                              r"|\s*\((?:kopia|copy)\))"),
+    "counter": ("suffix", r"\s*\(\d+\)"),                                      # "x (1)"
+    "version": ("suffix", r"[\s_.-]+v\d+(?:\.\d+)*"),                          # "x_V1.2", "x v2"
+}
+
+
+class NameNormalizer:
+    """Map file names to a key shared by their copy variants ("x (1).jpg", "Copy of x.jpg" -> "x.jpg").
+
+    The enabled rules of NAME_RULES (or custom {rule: (place, pattern)}
+    entries) are compiled into one regular expression, so a name is
+    normalized in a single match: any number of prefixes, the stem, any
+    number of suffixes and the extension. Matching ignores case, the key
+    keeps the case of the stem. Results are memoized per distinct name.
+    """
+
+    def __init__(self, rules=tuple(NAME_RULES)):
+        if not isinstance(rules, dict):
+            rules = {rule: NAME_RULES[rule] for rule in rules}
+        self.rules = tuple(rules)
+        prefixes = "|".join(pattern for place, pattern in rules.values() if place == "prefix") or "(?!)"
+        suffixes = "|".join(pattern for place, pattern in rules.values() if place == "suffix") or "(?!)"
+        self.pattern = re.compile(rf"(?:{prefixes})*(?P<stem>.*?)(?:{suffixes})*(?P<ext>\.[^.\s]*)?", re.IGNORECASE)
+        self.keys = {}
+
+    def __call__(self, name):
+        key = self.keys.get(name)
+        if key is None:
+            match = self.pattern.fullmatch(name)
+            stem = match.group("stem").strip().rstrip(".") if match else ""
+            # Z nazwy złożonej wyłącznie z przyrostków (np. "(1).jpg") nie zostałoby nic - zostawiamy ją
+            key = self.keys[name] = stem + (match.group("ext") or "") if stem else name
+        return key
+
+
+def parse_rules(text):
+    """Rule names from a comma separated list (as given on the command line)."""
+    rules = [rule.strip() for rule in text.split(",") if rule.strip()]
+    unknown = [rule for rule in rules if rule not in NAME_RULES]
+    if unknown:
+        raise ValueError(f"Unknown name rules: {', '.join(unknown)} (known: {', '.join(NAME_RULES)})")
+    return rules
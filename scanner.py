@@ -0,0 +1,205 @@
+import os
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import storage
+from file_table import FileTable
+
+# Skanowanie to głównie czekanie na I/O (NFS, dyski sieciowe), więc wątków może być więcej niż rdzeni
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+PROGRESS_INTERVAL = 0.2  # co ile sekund raportujemy postęp skanowania
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+def scan_dir(path):
+    """Scan a single directory and return (files, subdirs).
+
+    Files are (name, size, mtime_ns, dev, ino) tuples; both come from
+    DirEntry.stat(), so every file is stat-ed exactly once. st_dev and st_ino
+    identify hardlinks (ino is 0 where the platform does not report it).
+    Symlinked files are listed with their target's size and mtime, like
+    os.walk + getsize did, but with ino 0: the target's identity does not
+    belong to this directory and must not make them look like hardlinks.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        # Tak jak os.walk: nie wchodzimy w dowiązania do katalogów
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                    st = entry.stat()
+                    if entry.is_symlink():
+                        files.append((entry.name, st.st_size, st.st_mtime_ns, 0, 0))
+                    else:
+                        files.append((entry.name, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino))
+                except OSError:
+                    print(f'Błąd dostępu do pliku: {entry.path}')
+    except OSError:
+        print(f'Błąd dostępu do katalogu: {path}')
+    return files, subdirs
+
+
+class ScanIndex:
+    """On-disk index of scanned directories keyed by path and mtime.
+
+    A directory's mtime changes whenever an entry is added, removed or
+    renamed in it, so an unchanged mtime lets us reuse the cached file list
+    and subdirectory names without listing or stat-ing its files again.
+    Files rewritten in place keep the directory mtime, so their cached size
+    is refreshed only after a rescan without the index. Paths are stored
+    as os.fsencode() bytes, so names that are not valid UTF-8 work too.
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS dirs ("
+        "path BLOB PRIMARY KEY, mtime_ns INTEGER NOT NULL, "
+        "files TEXT NOT NULL, subdirs TEXT NOT NULL)",
+    ]
+
+    def __init__(self, name="scan_index"):
+        self.connection = storage.open_database(name, self.SCHEMA, version=5)
+
+    def lookup(self, path):
+        row = self.connection.execute(
+            "SELECT mtime_ns, files, subdirs FROM dirs WHERE path = ?", (os.fsencode(path),)).fetchone()
+        if row is None:
+            return None
+        mtime_ns, files, subdirs = row
+        files = [tuple(entry) for entry in json.loads(files)]
+        subdirs = [os.path.join(path, name) for name in json.loads(subdirs)]
+        return mtime_ns, files, subdirs
+
+    def store(self, path, mtime_ns, files, subdirs):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO dirs (path, mtime_ns, files, subdirs) VALUES (?, ?, ?, ?)",
+            (os.fsencode(path), mtime_ns,
+             json.dumps(files),
+             json.dumps([os.path.basename(subdir) for subdir in subdirs])))
+
+    def prune(self, folder, visited):
+        # Usuwamy wpisy katalogów, które zniknęły z drzewa
+        folder = os.fsencode(folder)
+        prefix = os.path.join(folder, b"")
+        rows = self.connection.execute(
+            "SELECT path FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+            (folder, len(prefix), prefix)).fetchall()
+        stale = [(path,) for (path,) in rows if os.fsdecode(path) not in visited]
+        self.connection.executemany("DELETE FROM dirs WHERE path = ?", stale)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def open_index():
+    try:
+        return ScanIndex()
+    except sqlite3.Error as e:
+        print(f'Błąd otwierania indeksu skanowania: {e}')
+        return None
+
+
+def scan_dir_cached(path, cached):
+    """Like scan_dir, but reuse `cached` = (mtime_ns, files, subdirs) if the mtime still matches.
+
+    Returns (mtime_ns, files, subdirs, reused).
+    """
+    try:
+        # mtime czytamy przed listowaniem, żeby zmiana w trakcie skanu wymusiła kolejny
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        print(f'Błąd dostępu do katalogu: {path}')
+        return None, [], [], False
+    if cached is not None and cached[0] == mtime_ns:
+        return mtime_ns, cached[1], cached[2], True
+    files, subdirs = scan_dir(path)
+    return mtime_ns, files, subdirs, False
+
+
+def walk(folder, workers=DEFAULT_WORKERS, index=None):
+    """Yield (dirpath, files) for every directory under folder.
+
+    Subdirectories are fanned out over a pool of at most `workers` threads,
+    so directories are yielded in completion order, not in os.walk order.
+    With an `index`, directories whose mtime did not change are taken from it;
+    the index is only touched from the thread iterating this generator.
+    """
+    folder = os.path.normpath(folder)
+    visited = set()
+
+    def submit(pool, path):
+        if index is None:
+            return pool.submit(scan_dir, path)
+        return pool.submit(scan_dir_cached, path, index.lookup(path))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = {submit(pool, folder): folder}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    if index is None:
+                        files, subdirs = future.result()
+                    else:
+                        mtime_ns, files, subdirs, reused = future.result()
+                        if mtime_ns is not None:
+                            visited.add(path)
+                            if not reused:
+                                index.store(path, mtime_ns, files, subdirs)
+                    for subdir in subdirs:
+                        pending[submit(pool, subdir)] = subdir
+                    yield path, files
+        finally:
+            # Przy przerwaniu nie czekamy na katalogi, które jeszcze nie wystartowały
+            for future in pending:
+                future.cancel()
+
+    if index is not None:
+        index.prune(folder, visited)
+        index.commit()
+
+
+def scan_tree(folder, workers=DEFAULT_WORKERS, use_index=False, progress=None, cancel=None):
+    """Scan the whole tree into a columnar FileTable.
+
+    Iterating the table still yields (name, size, path) tuples.
+
+    `progress(files, dirs, bytes)` is called at most every PROGRESS_INTERVAL
+    seconds; setting the `cancel` event stops the walk with ScanCancelled.
+    """
+    file_info = FileTable()
+    index = open_index() if use_index else None
+    dirs_seen = 0
+    bytes_seen = 0
+    last_report = time.monotonic()
+    walker = walk(folder, workers, index)
+    try:
+        for path, files in walker:
+            if cancel is not None and cancel.is_set():
+                raise ScanCancelled()
+            file_info.add_dir(path, files)
+            dirs_seen += 1
+            bytes_seen += sum(entry[1] for entry in files)
+            if progress is not None and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                progress(len(file_info), dirs_seen, bytes_seen)
+        if progress is not None:
+            progress(len(file_info), dirs_seen, bytes_seen)
+    finally:
+        walker.close()
+        if index is not None:
+            index.close()
+    return file_info
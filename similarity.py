@@ -0,0 +1,222 @@
+from collections import defaultdict
+import scanner
+from file_table import np
+
+SIMILAR_DISTANCE = 4  # ile z 64 bitów skrótu percepcyjnego może się różnić, żeby pliki uznać za podobne
+FRAME_DISTANCE = 6    # klatki filmu po ponownej kompresji różnią się bardziej niż zdjęcia
+SEQUENCE_MATCH = 0.5  # jaka część próbek krótszego filmu musi mieć odpowiedniki, w tej samej kolejności
+FLAT_HASHES = (0, (1 << 64) - 1)  # jednolite klatki (czarne przejścia, plansze) nie wskazują kandydatów
+DOCUMENT_SIMILARITY = 0.8  # szacowane podobieństwo Jaccarda fragmentów tekstu, od którego pliki są podobne
+LSH_BANDS = 16             # sygnatura MinHash dzielona na tyle pasm; próg kandydata ~ (1 / pasma) ** (1 / wiersze)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def close_pairs(values, radius=SIMILAR_DISTANCE, cancel=None):
+    """Yield index pairs (i, j) of 64-bit hashes that differ in at most `radius` bits.
+
+    Multi-index hashing: the bits are split into radius + 1 chunks, and two
+    hashes within `radius` agree exactly on at least one of them
+    (pigeonhole), so only hashes sharing a chunk value are compared. With
+    NumPy every chunk is bucketed by one sort and the pairs inside buckets
+    are checked a whole diagonal at a time. A pair may be yielded more than once.
+    """
+    chunks = radius + 1
+    bounds = [64 * i // chunks for i in range(chunks + 1)]
+    if np is None or not hasattr(np, "bitwise_count"):
+        for lo, hi in zip(bounds, bounds[1:]):
+            buckets = defaultdict(list)
+            for i, value in enumerate(values):
+                buckets[(value >> lo) & ((1 << (hi - lo)) - 1)].append(i)
+            for members in buckets.values():
+                if cancel is not None and cancel.is_set():
+                    raise scanner.ScanCancelled()
+                for x, i in enumerate(members):
+                    for j in members[x + 1:]:
+                        if hamming(values[i], values[j]) <= radius:
+                            yield i, j
+        return
+
+    hashes = np.array(values, dtype=np.uint64)
+    for lo, hi in zip(bounds, bounds[1:]):
+        if cancel is not None and cancel.is_set():
+            raise scanner.ScanCancelled()
+        keys = (hashes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        for first, second in equal_key_pairs(keys):
+            close = np.bitwise_count(hashes[first] ^ hashes[second]) <= radius
+            yield from zip(first[close].tolist(), second[close].tolist())
+
+
+def equal_key_pairs(keys):
+    """Yield (first, second) index arrays covering every pair of equal elements of a NumPy key array.
+
+    The keys are sorted once; pairs inside runs of equal keys are produced
+    a whole diagonal (a fixed distance apart in sorted order) at a time.
+    """
+    count = len(keys)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.ones(count, dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    # Dla każdej pozycji: koniec jej kubełka w posortowanej kolejności
+    run_ends = np.append(np.flatnonzero(starts)[1:], count)[np.cumsum(starts) - 1]
+    positions = np.flatnonzero(run_ends - np.arange(count) > 1)
+    offset = 1
+    while len(positions):
+        yield order[positions], order[positions + offset]
+        offset += 1
+        positions = positions[run_ends[positions] > positions + offset]
+
+
+def find_root(parents, i):
+    # Union-find z kompresją ścieżki
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def union(parents, i, j):
+    a, b = find_root(parents, i), find_root(parents, j)
+    if a != b:
+        parents[b] = a
+
+
+def cluster_hashes(hashes, radius=SIMILAR_DISTANCE, cancel=None):
+    """Group items whose hashes are within `radius` bits of each other (single linkage).
+
+    `hashes` is {item: 64-bit hash}. Identical hashes are matched once, as
+    one value. Returns lists of items, only for clusters of more than one.
+    """
+    by_hash = defaultdict(list)
+    for item, value in hashes.items():
+        by_hash[value].append(item)
+    values = list(by_hash)
+    parents = list(range(len(values)))
+    for i, j in close_pairs(values, radius, cancel):
+        union(parents, i, j)
+
+    clusters = defaultdict(list)
+    for i, value in enumerate(values):
+        clusters[find_root(parents, i)].extend(by_hash[value])
+    return [items for items in clusters.values() if len(items) > 1]
+
+
+def sequence_match(a, b, radius=FRAME_DISTANCE):
+    """Fraction of the shorter hash sequence matched, in order, by frames of the other within `radius` bits.
+
+    This is a longest common subsequence where "equal" means close, so a
+    few dropped, changed or shifted samples (a trimmed or re-cut copy) only
+    lower the score a little.
+    """
+    if not a or not b:
+        return 0.0
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            if hamming(x, y) <= radius:
+                current.append(previous[j] + 1)
+            else:
+                current.append(max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1] / min(len(a), len(b))
+
+
+def cluster_sequences(sequences, radius=FRAME_DISTANCE, threshold=SEQUENCE_MATCH, cancel=None):
+    """Group items whose hash sequences match by at least `threshold` (single linkage).
+
+    `sequences` is {item: [64-bit hash, ...]}, e.g. sampled video frames.
+    Candidate pairs are items sharing at least one close frame hash (found
+    with close_pairs over all frames); only those are compared in full with
+    sequence_match. Returns lists of items, only for clusters of more than one.
+    """
+    items = list(sequences)
+    values = []
+    owners = []
+    for n, item in enumerate(items):
+        for value in set(sequences[item]).difference(FLAT_HASHES):
+            values.append(value)
+            owners.append(n)
+    candidates = set()
+    for i, j in close_pairs(values, radius, cancel):
+        if owners[i] != owners[j]:
+            candidates.add((min(owners[i], owners[j]), max(owners[i], owners[j])))
+
+    parents = list(range(len(items)))
+    for n, (i, j) in enumerate(candidates):
+        if cancel is not None and n % 1000 == 0 and cancel.is_set():
+            raise scanner.ScanCancelled()
+        if find_root(parents, i) == find_root(parents, j):
+            continue  # już w jednej grupie - pełne porównanie niczego nie zmieni
+        if sequence_match(sequences[items[i]], sequences[items[j]], radius) >= threshold:
+            union(parents, i, j)
+
+    clusters = defaultdict(list)
+    for i, item in enumerate(items):
+        clusters[find_root(parents, i)].append(item)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def signature_similarity(a, b):
+    # Odsetek zgodnych pozycji sygnatur MinHash szacuje podobieństwo Jaccarda zbiorów
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def band_pairs(values, threshold=DOCUMENT_SIMILARITY, bands=LSH_BANDS, cancel=None):
+    # Pary (i, j) sygnatur ze wspólnym pasmem i szacowanym podobieństwem >= threshold; para może się powtórzyć
+    if not values:
+        return
+    rows = len(values[0]) // bands
+    if np is None:
+        for band in range(bands):
+            if cancel is not None and cancel.is_set():
+                raise scanner.ScanCancelled()
+            buckets = defaultdict(list)
+            for i, value in enumerate(values):
+                buckets[value[band * rows:(band + 1) * rows]].append(i)
+            for members in buckets.values():
+                for x, i in enumerate(members):
+                    for j in members[x + 1:]:
+                        if signature_similarity(values[i], values[j]) >= threshold:
+                            yield i, j
+        return
+
+    matrix = np.array(values, dtype=np.uint64)
+    for band in range(bands):
+        if cancel is not None and cancel.is_set():
+            raise scanner.ScanCancelled()
+        # Pasmo składamy w jeden klucz 64-bitowy; przypadkowe kolizje odpadną przy sprawdzaniu całej sygnatury
+        keys = np.zeros(len(matrix), dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for column in matrix[:, band * rows:(band + 1) * rows].T:
+                keys = keys * np.uint64(0x100000001B3) + column
+        for first, second in equal_key_pairs(keys):
+            similar = (matrix[first] == matrix[second]).mean(axis=1) >= threshold
+            yield from zip(first[similar].tolist(), second[similar].tolist())
+
+
+def cluster_signatures(signatures, threshold=DOCUMENT_SIMILARITY, bands=LSH_BANDS, cancel=None):
+    """Group items whose MinHash signatures estimate a Jaccard similarity of at least `threshold`.
+
+    `signatures` is {item: [int, ...]}, all of one length. LSH banding: the
+    signature is cut into `bands` bands and items equal on a whole band
+    share a bucket, so only items sharing a bucket become candidate pairs
+    (with 16 bands of 8 rows, pairs below ~0.7 rarely do). Candidates are
+    then checked on the full signature. Identical signatures are matched
+    once. Returns lists of items, only for clusters of more than one.
+    """
+    by_signature = defaultdict(list)
+    for item, signature in signatures.items():
+        by_signature[tuple(signature)].append(item)
+    values = list(by_signature)
+    parents = list(range(len(values)))
+    for i, j in band_pairs(values, threshold, bands, cancel):
+        union(parents, i, j)
+
+    clusters = defaultdict(list)
+    for i, value in enumerate(values):
+        clusters[find_root(parents, i)].extend(by_signature[value])
+    return [items for items in clusters.values() if len(items) > 1]
@@ -0,0 +1,39 @@
+import os
+import sys
+import sqlite3
+
+APP_NAME = "file_manager"
+
+
+def cache_dir():
+    """Return (and create) the per-user cache directory of the application."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def open_database(name, schema, version=1):
+    """Open an SQLite database in the cache directory.
+
+    `schema` is a list of CREATE statements. When the stored user_version
+    differs from `version` all tables are dropped and recreated, since
+    everything kept here can be rebuilt from the filesystem.
+    """
+    connection = sqlite3.connect(os.path.join(cache_dir(), f"{name}.sqlite3"))
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    if connection.execute("PRAGMA user_version").fetchone()[0] != version:
+        tables = connection.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        for (table,) in tables:
+            connection.execute(f"DROP TABLE IF EXISTS {table}")
+        connection.execute(f"PRAGMA user_version={int(version)}")
+    for statement in schema:
+        connection.execute(statement)
+    connection.commit()
+    return connection
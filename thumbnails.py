@@ -0,0 +1,423 @@
+import io
+import os
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+from PIL import Image
+import sqlite3
+import hash_pool
+import storage
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv', '.avi')
+VIDEO_FRAME_SIZE = 400             # klatkę z filmu trzymamy w największym rozmiarze podglądu
+VIDEO_SEEK_FRACTION = 0.1          # klatka z ~10% długości jest zwykle bardziej reprezentatywna niż pierwsza
+MEMORY_LIMIT = 64 * 1024 * 1024    # ile bajtów zdekodowanych miniatur trzymamy w pamięci
+DISK_LIMIT = 512 * 1024 * 1024     # ile bajtów miniatur trzymamy na dysku
+VIDEO_SAMPLE_SECONDS = 2.0         # co ile sekund filmu bierzemy klatkę do odcisku
+VIDEO_SAMPLES = 64                 # najwięcej klatek w odcisku; dłuższe filmy próbkujemy co 2x, 4x... rzadziej
+
+
+def is_image(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_video(path):
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def exif_thumbnail(image, size):
+    """Return the JPEG thumbnail embedded in EXIF (IFD1) if it is big enough, else None.
+
+    Only previews at least `size` pixels on the longer side and with the same
+    aspect ratio as the photo are used, so letterboxed camera thumbnails are skipped.
+    """
+    raw = image.info.get("exif")
+    if not raw or not raw.startswith(b"Exif\x00\x00"):
+        return None
+    tiff = raw[6:]
+    try:
+        endian = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        ifd0 = struct.unpack(endian + "I", tiff[4:8])[0]
+        count = struct.unpack(endian + "H", tiff[ifd0:ifd0 + 2])[0]
+        ifd1 = struct.unpack(endian + "I", tiff[ifd0 + 2 + 12 * count:ifd0 + 6 + 12 * count])[0]
+        if not ifd1:
+            return None
+        offset = length = None
+        count = struct.unpack(endian + "H", tiff[ifd1:ifd1 + 2])[0]
+        for i in range(count):
+            entry = tiff[ifd1 + 2 + 12 * i:ifd1 + 14 + 12 * i]
+            tag, _, _, value = struct.unpack(endian + "HHII", entry)
+            if tag == 0x0201:
+                offset = value
+            elif tag == 0x0202:
+                length = value
+        if offset is None or not length:
+            return None
+        thumbnail = Image.open(io.BytesIO(tiff[offset:offset + length]))
+        thumbnail.load()
+    except (KeyError, struct.error, OSError, SyntaxError):
+        return None
+    if max(thumbnail.size) < size:
+        return None
+    if abs(thumbnail.width / thumbnail.height - image.width / image.height) > 0.02:
+        return None
+    return thumbnail
+
+
+def open_preview_image(path, size, use_exif=True):
+    """Open an image for a size x size preview, decoding as little of it as possible.
+
+    For JPEG the embedded EXIF thumbnail is used when it is large enough
+    (and `use_exif` is set), otherwise draft mode lets libjpeg decode at
+    1/2, 1/4 or 1/8 scale (DCT scaling). Other formats are decoded in full.
+    """
+    image = Image.open(path)
+    if image.format == "JPEG":
+        embedded = exif_thumbnail(image, size) if use_exif else None
+        if embedded is not None:
+            return embedded
+        image.draft(image.mode, (size, size))
+    return image
+
+
+def fourcc_text(value):
+    value = int(value)
+    return "".join(chr((value >> 8 * i) & 0xFF) for i in range(4)).strip("\x00 ")
+
+
+def video_metadata(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    return {
+        "duration": frames / fps if fps > 0 and frames > 0 else 0.0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "codec": fourcc_text(cap.get(cv2.CAP_PROP_FOURCC)),
+    }
+
+
+def open_video(path):
+    """cv2.VideoCapture of a video; raises ValueError when it cannot be opened.
+
+    OpenCV takes only UTF-8 file names (others crash it), so a name that
+    is not valid UTF-8 is passed as /proc/self/fd/N of a descriptor opened
+    here, where /proc is available.
+    """
+    try:
+        path.encode("utf-8")
+    except UnicodeEncodeError:
+        if not os.path.isdir("/proc/self/fd"):
+            raise ValueError(f"Cannot open video {path}")
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            cap = cv2.VideoCapture(f"/proc/self/fd/{fd}")
+        finally:
+            os.close(fd)  # FFmpeg otworzył plik od nowa przez dowiązanie w /proc
+    else:
+        cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        cap.release()
+        raise ValueError(f"Cannot open video {path}")
+    return cap
+
+
+def read_video_frame(path, seek_fraction=VIDEO_SEEK_FRACTION):
+    """Return (RGB PIL image, metadata) for a representative frame of a video.
+
+    The frame is taken from about `seek_fraction` of the length; containers
+    that cannot seek fall back to the first frame.
+    """
+    cap = open_video(path)
+    try:
+        metadata = video_metadata(cap)
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        ret = False
+        if seek_fraction and frames > 1:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(frames * seek_fraction))
+            ret, frame_img = cap.read()
+        if not ret:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame_img = cap.read()
+    finally:
+        cap.release()
+    if not ret:
+        raise ValueError(f"No frames in {path}")
+    return Image.fromarray(cv2.cvtColor(frame_img, cv2.COLOR_BGR2RGB)), metadata
+
+
+def fit_thumbnail(image, size):
+    image.thumbnail((size, size))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    return image
+
+
+def render_thumbnail(path, size, video_info=None):
+    """Decode an image or a representative video frame and shrink it to fit size x size.
+
+    Video metadata read on the way is stored in `video_info` (a VideoInfoCache).
+    """
+    if is_image(path):
+        image = open_preview_image(path, size)
+    elif is_video(path):
+        image, metadata = read_video_frame(path)
+        if video_info is not None:
+            video_info.store(path, metadata)
+    else:
+        raise ValueError(f"No preview for {path}")
+    return fit_thumbnail(image, size)
+
+
+class VideoInfoCache:
+    """Persistent duration/resolution/codec of videos keyed by path (as bytes), mtime and size.
+
+    Every thread gets its own SQLite connection, so the cache can be shared
+    by the preview pool and the scanning thread.
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS videos ("
+        "path BLOB PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+        "duration REAL NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL, codec TEXT NOT NULL)",
+    ]
+
+    def __init__(self, name="video_info"):
+        self.name = name
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = storage.open_database(self.name, self.SCHEMA, version=2)
+        return self.local.connection
+
+    def store(self, path, metadata):
+        try:
+            st = os.stat(path)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO videos (path, mtime_ns, size, duration, width, height, codec) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.fsencode(path), st.st_mtime_ns, st.st_size, metadata["duration"],
+                 metadata["width"], metadata["height"], metadata["codec"]))
+            self.connection.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f'Błąd zapisu informacji o filmie: {e}')
+
+    def get(self, path):
+        """Return cached metadata of a video, opening it (without decoding frames) only on a miss."""
+        st = os.stat(path)
+        row = self.connection.execute(
+            "SELECT duration, width, height, codec FROM videos WHERE path = ? AND mtime_ns = ? AND size = ?",
+            (os.fsencode(path), st.st_mtime_ns, st.st_size)).fetchone()
+        if row is not None:
+            return dict(zip(("duration", "width", "height", "codec"), row))
+        cap = open_video(path)
+        try:
+            metadata = video_metadata(cap)
+        finally:
+            cap.release()
+        self.store(path, metadata)
+        return metadata
+
+
+def comparison_key(metadata):
+    # Czas zaokrąglamy do sekundy - kontenery różnie raportują liczbę klatek
+    return (round(metadata["duration"]), metadata["width"], metadata["height"], metadata["codec"])
+
+
+def difference_bits(pixels):
+    # 9x8 pikseli w skali szarości -> 64 bity: czy piksel jest jaśniejszy od prawego sąsiada
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def dhash(path):
+    """64-bit difference hash: a 9x8 grayscale copy, one bit per pair of horizontal neighbours.
+
+    Resizing and re-encoding change only a few bits, so copies of the same
+    photo stay within a small Hamming distance.
+    """
+    # JPEG dekodujemy w zmniejszonej skali; miniatury EXIF edytory często nie odświeżają po kadrowaniu
+    image = open_preview_image(path, 64, use_exif=False)
+    return difference_bits(image.convert("L").resize((9, 8), Image.BILINEAR).tobytes())
+
+
+def video_fingerprint(path, interval=VIDEO_SAMPLE_SECONDS, samples=VIDEO_SAMPLES):
+    """Return the dHashes of frames taken every `interval` seconds of a video, in playback order.
+
+    Samples sit at fixed times rather than fractions of the length, so a
+    trimmed copy shares most of its samples with the original. Long videos
+    double the interval until at most `samples` frames are taken; the grids
+    stay nested, so copies of different lengths still line up. Frames are
+    reached by seeking; when the length is unknown the video is read through.
+    """
+    cap = open_video(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        duration = frames / fps if fps > 0 and frames > 0 else 0
+        while duration / interval >= samples:
+            interval *= 2
+        hashes = []
+        seconds = 0.0
+        while len(hashes) < samples:
+            if duration:
+                if seconds >= duration:
+                    break
+                cap.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000)
+            elif not cap.grab():
+                break
+            elif cap.get(cv2.CAP_PROP_POS_MSEC) < seconds * 1000:
+                continue  # długość nieznana - przewijamy klatka po klatce do chwili następnej próbki
+            ret, frame_img = cap.read() if duration else cap.retrieve()
+            seconds += interval
+            if not ret:
+                continue
+            gray = cv2.cvtColor(frame_img, cv2.COLOR_BGR2GRAY)
+            hashes.append(difference_bits(cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).tobytes()))
+    finally:
+        cap.release()
+    if not hashes:
+        raise ValueError(f"No frames in {path}")
+    return hashes
+
+
+def hash_image(path):
+    # Wykonywane w procesie puli; zwraca None dla plików, których nie da się zdekodować
+    try:
+        return path, f"{dhash(path):016x}"
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return path, None
+
+
+def hash_video(path):
+    # Wykonywane w procesie puli; skróty klatek zapisujemy jako tekst "hex,hex,..."
+    try:
+        return path, ",".join(f"{value:016x}" for value in video_fingerprint(path))
+    except (OSError, ValueError, cv2.error):
+        return path, None
+
+
+def image_hashes(items, cache=None, cancel=None, workers=hash_pool.DEFAULT_WORKERS):
+    """Return {path: dHash} for the images among (size, path) items.
+
+    Hashes are kept in `cache` (a hashing.HashCache) by stat identity, so
+    only new or changed images are decoded, in a process pool.
+    """
+    paths = [path for _, path in items if is_image(path)]
+    found = hash_pool.cached_hashes(paths, "dhash", hash_image, cache, cancel, workers, chunksize=32)
+    return {path: int(value, 16) for path, value in found.items()}
+
+
+def video_fingerprints(items, cache=None, cancel=None, workers=hash_pool.DEFAULT_WORKERS):
+    """Return {path: [frame dHash, ...]} for the videos among (size, path) items, cached like image_hashes."""
+    paths = [path for _, path in items if is_video(path)]
+    # Filmy dekodują się długo - po jednym na zadanie, żeby praca rozkładała się równo
+    found = hash_pool.cached_hashes(paths, "frames", hash_video, cache, cancel, workers)
+    return {path: [int(part, 16) for part in value.split(",")] for path, value in found.items()}
+
+
+def image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class ThumbnailCache:
+    """Two-tier thumbnail cache: an LRU of decoded images bounded by bytes,
+    in front of PNG files on disk keyed by path, mtime, size and thumbnail size.
+    Safe to use from several threads at once.
+    """
+
+    def __init__(self, memory_limit=MEMORY_LIMIT, disk_limit=DISK_LIMIT, video_info=None):
+        self.video_info = video_info
+        self.memory = OrderedDict()
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self.lock = threading.Lock()
+        self.directory = os.path.join(storage.cache_dir(), "thumbnails")
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune_disk(disk_limit)
+
+    def key(self, path, size):
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size, size)
+
+    def peek(self, path, size):
+        """Return the thumbnail only if it is already in memory, without touching the disk tier."""
+        try:
+            key = self.key(path, size)
+        except OSError:
+            return None
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+            return image
+
+    def get(self, path, size):
+        """Return a PIL thumbnail of path, decoding the original only on a miss in both tiers."""
+        key = self.key(path, size)
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+                return image
+
+        disk_path = os.path.join(self.directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".png")
+        try:
+            with Image.open(disk_path) as cached:
+                image = cached.copy()
+            os.utime(disk_path)  # data modyfikacji służy za czas ostatniego użycia
+        except (OSError, ValueError):
+            if is_video(path) and size != VIDEO_FRAME_SIZE:
+                # Film otwieramy raz - mniejsze miniatury powstają z zapamiętanej klatki
+                image = fit_thumbnail(self.get(path, VIDEO_FRAME_SIZE).copy(), size)
+            else:
+                image = render_thumbnail(path, size, self.video_info)
+            self.save(image, disk_path)
+
+        self.remember(key, image)
+        return image
+
+    def save(self, image, disk_path):
+        tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            image.save(tmp_path, "PNG")
+            os.replace(tmp_path, disk_path)
+        except OSError as e:
+            print(f'Błąd zapisu miniatury: {e}')
+
+    def remember(self, key, image):
+        with self.lock:
+            previous = self.memory.pop(key, None)
+            if previous is not None:
+                self.memory_used -= image_bytes(previous)
+            self.memory[key] = image
+            self.memory_used += image_bytes(image)
+            while self.memory_used > self.memory_limit and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_used -= image_bytes(evicted)
+
+    def prune_disk(self, limit):
+        # Usuwamy najdawniej używane miniatury, aż zmieścimy się w limicie
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass